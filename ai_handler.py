@@ -1,165 +1,381 @@
 # ai_handler.py
 """Handles interaction with the Gemini API using batch questions."""
 
-import google.generativeai as genai
+import asyncio
 import datetime
+import io
 import json
 import os
+import re
+import shelve
+import time
+import atexit
 import config # Import constants
+from data_utils import normalize_ratio
 import traceback # <--- Added for detailed error printing
 
+# Optional: orjson serializes log entries faster than stdlib json (same UTF-8 output)
+try:
+    import orjson
+    def _dumps_line(obj): return orjson.dumps(obj) + b"\n"
+except ImportError:
+    def _dumps_line(obj): return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
 # Store API Key globally within this module after configuration
 _GEMINI_API_KEY_CONFIGURED = None
 
+# --- Persistent classification cache (Ticker|Ratio|ExDate -> {"result": ..., "ts": epoch, "ex_date": ...}) ---
+_AI_CACHE_TTL = config.AI_CACHE_TTL_DAYS * 86400
+
+def _is_fresh(entry, now=None):
+    """True while a cached entry may be served: younger than AI_CACHE_TTL_DAYS and its ex-date not yet passed."""
+    if (now or time.time()) - entry.get('ts', 0) >= _AI_CACHE_TTL: return False
+    # Only upcoming splits are ever looked up, so an answer for a past ex-date is dead weight
+    return str(entry.get('ex_date') or '9999')[:10] >= datetime.date.today().isoformat()
+
+def _open_ai_cache(filepath=config.AI_CACHE_PATH):
+    """
+    Opens the on-disk AI result cache. Returns (shelf, in-memory copy of its live entries),
+    or (None, {}) if disabled/unavailable.
+    """
+    if not config.AI_CACHE_ENABLED: return None, {}
+    try:
+        dir_name = os.path.dirname(filepath)
+        if dir_name: os.makedirs(dir_name, exist_ok=True)
+        cache = shelve.open(filepath, writeback=False)
+        atexit.register(cache.close)
+        # Evict entries past the TTL or their ex-date (or from the old un-timestamped format)
+        # The eviction scan already unpickles every entry, so the live ones are kept in memory:
+        # lookups become dict hits and the shelf is only touched again to write new results
+        now = time.time()
+        live, expired = {}, []
+        for k, v in cache.items():
+            # '~TICKER|ratio' keys predate announcement-scoped structural keys and are never looked up again
+            if not isinstance(v, dict) or (k.startswith('~') and k.count('|') == 1) or not _is_fresh(v, now):
+                expired.append(k)
+            else: live[k] = v
+        for key in expired: del cache[key]
+        print(f"Loaded {len(live)} AI cache entries from '{filepath}' ({len(expired)} expired).")
+        return cache, live
+    except Exception as e:
+        print(f"Warning: Could not open AI cache at {filepath}: {e}. Caching disabled.")
+        return None, {}
+
+_cache, _cache_memo = _open_ai_cache()
+
+def _cache_key(split_info):
+    """Builds the cache key for a reverse split entry."""
+    return f"{split_info.get('ticker', 'N/A')}|{split_info.get('ratio', 'N/A')}|{split_info.get('ex_date', 'N/A')}"
+
+def _parse_ex_date(split_info):
+    """The split's ex-date as a date, or None if missing/unparseable."""
+    try: return datetime.date.fromisoformat(str(split_info.get('ex_date', ''))[:10])
+    except ValueError: return None
+
+def _structural_key(split_info, month=None):
+    """
+    Builds a format-insensitive key: upper-cased ticker + canonical ratio + ex-date month (YYYY-MM),
+    so '1-for-10' vs '1:10' still hit while a later split at the same ratio is a separate corporate action.
+    """
+    ratio = normalize_ratio(split_info.get('ratio')) or split_info.get('ratio', 'N/A')
+    if month is None:
+        ex_date = _parse_ex_date(split_info)
+        month = ex_date.strftime('%Y-%m') if ex_date else 'N/A'
+    return f"~{str(split_info.get('ticker', 'N/A')).strip().upper()}|{ratio}|{month}"
+
+def _structural_match(split_info, now=None):
+    """
+    Finds a fresh structural entry for this split's announcement: same ticker and canonical ratio with an ex-date
+    within AI_SAME_SPLIT_WINDOW_DAYS (checks this month and the neighbouring ones the window reaches), or None.
+    """
+    ex_date = _parse_ex_date(split_info)
+    if ex_date is None:
+        entry = _cache_memo.get(_structural_key(split_info))
+        return entry if entry is not None and _is_fresh(entry, now) else None
+    window = datetime.timedelta(days=config.AI_SAME_SPLIT_WINDOW_DAYS)
+    months = dict.fromkeys(d.strftime('%Y-%m') for d in (ex_date, ex_date - window, ex_date + window))
+    for month in months:
+        entry = _cache_memo.get(_structural_key(split_info, month))
+        entry_date = _parse_ex_date(entry) if entry else None
+        if entry_date and abs(entry_date - ex_date) <= window and _is_fresh(entry, now): return entry
+    return None
+
+def _rule_classification(split_info):
+    """Applies config.AI_RATIO_RULES to a split; returns a definitive phrase or None."""
+    rule = config.AI_RATIO_RULES.get(normalize_ratio(split_info.get('ratio')))
+    if rule is None: return None
+    try:
+        verdict = rule(split_info) if callable(rule) else rule
+    except Exception as e:
+        print(f"Warning: Ratio rule failed for {split_info.get('ticker', 'N/A')}: {e}")
+        return None
+    return verdict if verdict in config.DEFINITIVE_PHRASES else None
+
+def get_cached_classification(split_info):
+    """Returns a known classification (ratio rule, then exact cache key, then structural key), or None."""
+    verdict = _rule_classification(split_info)
+    if verdict is not None: return verdict
+    if _cache is None: return None
+    # TTL is re-checked here, not just when the cache is opened, since --serve keeps one process running for days
+    now = time.time()
+    entry = _cache_memo.get(_cache_key(split_info))
+    if entry is not None and _is_fresh(entry, now): return entry['result']
+    entry = _structural_match(split_info, now)
+    return entry['result'] if entry is not None else None
+
 def configure_gemini(api_key):
-    """Configures the Gemini API if a key is provided."""
+    """Records the Gemini API key if provided; the SDK itself is imported/configured lazily on first use."""
     global _GEMINI_API_KEY_CONFIGURED
     if api_key:
-        try:
-            genai.configure(api_key=api_key)
-            _GEMINI_API_KEY_CONFIGURED = api_key
-            print(f"Gemini API configured for {config.AI_MODEL_NAME}.")
-            return True
-        except Exception as e:
-            print(f"Warning: Error configuring Gemini API: {e}. AI validation skipped.")
-            _GEMINI_API_KEY_CONFIGURED = None
-            return False
+        _GEMINI_API_KEY_CONFIGURED = api_key
+        print(f"Gemini API key set for {config.AI_MODEL_NAME}.")
+        return True
     else:
         print("No Gemini API Key provided. AI validation will be skipped.")
         _GEMINI_API_KEY_CONFIGURED = None
         return False
 
+# google.generativeai is slow to import (gRPC stubs), so only load it when a request is actually sent
+_genai = None
+
+def _ensure_gemini():
+    """Imports and configures the Gemini SDK on first call. Returns the module, or None on failure."""
+    global _genai
+    if _genai is None:
+        try:
+            import google.generativeai as genai
+            genai.configure(api_key=_GEMINI_API_KEY_CONFIGURED)
+            _genai = genai
+            print(f"Gemini API configured for {config.AI_MODEL_NAME}.")
+        except Exception as e:
+            print(f"Warning: Error configuring Gemini API: {e}. AI validation skipped.")
+    return _genai
+
+# --- Simple Prompt Header - Focuses on OUTPUT FORMAT ---
+# Built once at import so every request shares a byte-identical static prefix
+# (lets provider-side prompt caching hit); only the question list varies.
+_PROMPT_HEADER = f"""
+ANSWER THE FOLLOWING QUESTIONS:
+How will [Ticker] reverse split fractional shares be handled?,
+How will [Companyname] reverse split fractional shares be handled?
+
+ONLY ANSWER IN THE FOLLOWING CONCLUSION:
+[Ticker]: {config.OUTPUT_ROUND_UP}
+[Ticker]: {config.OUTPUT_CASH}
+
+**Questions:**
+"""
+
+# --- Precompiled response parsers ---
+# "[N.] Ticker: Result" -> (Ticker, Result)
+_RESPONSE_LINE_RE = re.compile(r'^\s*(?:\d+\.\s*)?([^:]*?)\s*:\s*(.*?)\s*$')
+# Result must start with one of the exact classification phrases (case-insensitive)
+_CLASSIFICATION_RE = re.compile(
+    r'^(' + '|'.join(re.escape(p) for p in config.CLASSIFICATION_PHRASES) + r')(?![\w-])', re.IGNORECASE)
+# Lower-cased phrase -> canonical phrase, so results share the config string objects
+_PHRASE_BY_LOWER = { phrase.lower(): phrase for phrase in config.CLASSIFICATION_PHRASES }
+
+# --- AI log handle, opened lazily and kept open for the process lifetime ---
+_log_fh = None
+
+def _close_ai_log():
+    """Closes the AI log handle at interpreter exit."""
+    if _log_fh: _log_fh.close()
+
+atexit.register(_close_ai_log)
+
 # --- Log function signature matches batch request ---
 def log_ai_response(log_filepath, timestamp, tickers_requested, raw_response_text):
     """Appends AI call log entry to a JSON Lines file."""
+    global _log_fh
     log_entry = {
         "timestamp": timestamp, "model_used": config.AI_MODEL_NAME,
         "tickers_requested": tickers_requested, # Log the list of tickers
         "raw_response_text": raw_response_text
     }
     try:
-        dir_name = os.path.dirname(log_filepath);
-        if dir_name: os.makedirs(dir_name, exist_ok=True)
-        with open(log_filepath, 'a', encoding='utf-8') as f:
-            json.dump(log_entry, f, ensure_ascii=False); f.write('\n')
+        if _log_fh is None or _log_fh.name != log_filepath:
+            _close_ai_log()
+            dir_name = os.path.dirname(log_filepath);
+            if dir_name: os.makedirs(dir_name, exist_ok=True)
+            _log_fh = open(log_filepath, 'ab', buffering=64 * 1024)
+        _log_fh.write(_dumps_line(log_entry)) # Serialize once, single write
+        _log_fh.flush()
     except Exception as e: print(f"Warning: Could not write AI log: {e}")
 
 
-# --- REVERTED get_batch_ai_validation FOR SIMPLE QUESTION PROMPT (BATCH) ---
-def get_batch_ai_validation(reverse_split_list):
-    """
-    Sends batch request to Gemini API using a simple question format for each split.
-    Returns classification {ticker: classification_string}. Logs raw response.
-    Includes detailed error printing on API failure.
-    """
-    if not _GEMINI_API_KEY_CONFIGURED: return {}
-    if not reverse_split_list: return {}
-    model = genai.GenerativeModel(config.AI_MODEL_NAME)
-
-    # --- Define the EXACT classification phrases from config ---
-    CLASSIFICATION_PHRASES = config.CLASSIFICATION_PHRASES
-    OUTPUT_ROUND_UP = config.OUTPUT_ROUND_UP
-    OUTPUT_CASH = config.OUTPUT_CASH
-    OUTPUT_UNKNOWN = config.OUTPUT_UNKNOWN
-
-    # --- Simple Prompt Header - Focuses on OUTPUT FORMAT ---
-    prompt_header = f"""
-ANSWER THE FOLLOWING QUESTIONS:
-How will [Ticker] reverse split fractional shares be handled?,
-How will [Companyname] reverse split fractional shares be handled?
-
-ONLY ANSWER IN THE FOLLOWING CONCLUSION:
-[Ticker]: Rounding Up Likely
-[Ticker]: Cash-in-Lieu Likely
-
-**Questions:**
-"""
-
-    prompt_body = ""
-    tickers_sent_map = {} # Map line number to ticker for accurate tracking
-    line_num = 1
-    for split_info in reverse_split_list:
+# --- Prompt building / response parsing (shared by every sub-batch) ---
+def _build_prompt(split_batch):
+    """Builds the simple-question prompt for a batch. Returns (full_prompt, unique_tickers_list)."""
+    body_lines = []
+    for line_num, split_info in enumerate(split_batch, start=1):
         ticker = split_info.get('ticker', 'N/A')
         ex_date_str = split_info.get('ex_date', 'N/A')
         # Format the simple question
         # Added ratio for slightly more context for the AI
         ratio_str = split_info.get('ratio', 'N/A')
-        prompt_body += f"{line_num}. Is {ticker}'s {ratio_str} reverse split fractional shares going to round up or be cash-in-lieu? (Ex-Date approx {ex_date_str})\n"
-        tickers_sent_map[line_num] = ticker # Store ticker associated with line number
-        line_num += 1
+        body_lines.append(f"{line_num}. Is {ticker}'s {ratio_str} reverse split fractional shares going to round up or be cash-in-lieu? (Ex-Date approx {ex_date_str})")
 
-    full_prompt = prompt_header + prompt_body.strip()
+    prompt_body = "\n".join(body_lines) # Single join instead of repeated string +=
     # Get the list of unique tickers sent in this batch for logging/error handling
-    tickers_sent_list = list(dict.fromkeys([info['ticker'] for info in reverse_split_list if 'ticker' in info]))
+    tickers_sent_list = list(dict.fromkeys([info['ticker'] for info in split_batch if 'ticker' in info]))
+    return _PROMPT_HEADER + prompt_body, tickers_sent_list
 
-    print(f"Sending batch request (Simple Question Format) to Gemini for {len(tickers_sent_list)} unique tickers...")
-    # Map will store {ticker: classification_string}
-    ai_results_map = {}
-    response_text = ""
-    log_timestamp = datetime.datetime.now().isoformat()
-
-    try:
-        generation_config = {'temperature': config.AI_REQUEST_TEMPERATURE} # Use temp from config
-        response = model.generate_content(full_prompt, generation_config=generation_config)
-        response_text = response.text
-        print(f"  Received response from Gemini. Logging raw text...")
-        # Log using the list of unique tickers sent
-        log_ai_response(config.AI_LOG_FILE_PATH, log_timestamp, tickers_sent_list, response_text)
-
-    # --- MODIFIED EXCEPTION BLOCK ---
-    except Exception as e:
+def _report_api_error(e):
+    """Prints a Gemini API error (full traceback only if AI_VERBOSE_ERRORS)."""
+    if config.AI_VERBOSE_ERRORS:
         print(f"\n---!!! Gemini API Error Encountered !!!---")
         print(f"Error Type: {type(e).__name__}")
         print(f"Error Message: {e}")
         print("--- Full Traceback ---")
         traceback.print_exc() # Print the detailed traceback
         print("--- End Traceback ---")
-        # Return simple error map using the list of unique tickers
-        return {t: "AI API Error" for t in tickers_sent_list}
-    # --- END MODIFIED EXCEPTION BLOCK ---
+    else:
+        print(f"Gemini API error: {e!r}")
 
-    # --- Parsing Logic (Expects only Ticker: Classification) ---
+def _parse_ai_response(response_text, tickers_sent_list):
+    """Parses 'Ticker: Classification' lines. Returns {ticker: classification_string}."""
     print("Parsing AI response...")
-    response_lines = response_text.splitlines()
-    allowed_results_lower = { phrase.lower() for phrase in CLASSIFICATION_PHRASES }
-    result_map_lower_to_proper = { phrase.lower(): phrase for phrase in CLASSIFICATION_PHRASES }
+    tickers_sent_set = frozenset(tickers_sent_list) # O(1) membership checks while parsing
+    response_lines = io.StringIO(response_text) # Lazy line iteration, no list materialization
 
     # Initialize results map with defaults for all requested unique tickers
-    for ticker in tickers_sent_list:
-         ai_results_map[ticker] = "AI Response Missing" # Default
+    ai_results_map = {ticker: "AI Response Missing" for ticker in tickers_sent_list} # Default
 
     processed_tickers = set() # Track tickers we found a response for
     for line in response_lines:
-        line = line.strip()
-        if not line: continue
-        # Handle potential numbering like "1. Ticker: Result"
-        if '.' in line:
-            potential_num = line.split('.', 1)[0]
-            if potential_num.isdigit():
-                 # It looks like a numbered list item, remove number and dot
-                 line = line.split('.', 1)[1].strip()
-
-        parts = line.split(":", 1)
-        if len(parts) == 2:
-            ticker_from_ai, result_from_ai = parts[0].strip(), parts[1].strip()
-            result_lower = result_from_ai.lower()
+        # Single regex pass strips any "1." numbering and splits "Ticker: Result"
+        line_match = _RESPONSE_LINE_RE.match(line)
+        if line_match:
+            ticker_from_ai, result_from_ai = line_match.group(1), line_match.group(2)
 
             # Check if this ticker was actually requested AND hasn't been processed yet
-            if ticker_from_ai in tickers_sent_list and ticker_from_ai not in processed_tickers:
-                if result_lower in allowed_results_lower:
-                    ai_results_map[ticker_from_ai] = result_map_lower_to_proper[result_lower]
+            if ticker_from_ai in tickers_sent_set and ticker_from_ai not in processed_tickers:
+                class_match = _CLASSIFICATION_RE.match(result_from_ai)
+                if class_match:
+                    ai_results_map[ticker_from_ai] = _PHRASE_BY_LOWER[class_match.group(1).lower()]
                 else:
-                    # Didn't match expected phrases exactly
+                    # Didn't match expected phrases
                     print(f"Warning: Unexpected AI result format for {ticker_from_ai}: '{result_from_ai}'")
                     ai_results_map[ticker_from_ai] = "AI Response Unclear"
                 processed_tickers.add(ticker_from_ai) # Mark as processed
+                if len(processed_tickers) == len(tickers_sent_set): break # Every ticker answered
             # else: Ignore unexpected/repeated tickers
 
     # Final check for any tickers requested but not found in the response
-    missing_tickers = set(tickers_sent_list) - processed_tickers
+    missing_tickers = tickers_sent_set - processed_tickers
     if missing_tickers:
          print(f"Warning: AI response still missing for expected tickers: {missing_tickers}")
          # The map already has "AI Response Missing" as default for these
 
     print(f"Finished parsing AI classification. Results obtained for {len(processed_tickers)}/{len(tickers_sent_list)} tickers.")
-    return ai_results_map # Returns {ticker: classification_string}
\ No newline at end of file
+    return ai_results_map
+
+def _split_identity(split_info):
+    """(ticker, canonical ratio): the identity a split is deduped and asked under ('1:10' and '1-for-10' are one question)."""
+    ratio = split_info.get('ratio', 'N/A')
+    return split_info.get('ticker', 'N/A'), normalize_ratio(ratio) or ratio
+
+def _plan_batches(unique_splits, batch_size):
+    """
+    Chunks splits into sub-batches of at most batch_size with no ticker twice in one batch
+    (answers come back as 'Ticker: Result', so a second ratio for the same ticker goes in a later batch).
+    """
+    rounds = [] # k-th split of each ticker -> rounds[k]
+    seen_per_ticker = {}
+    for split_info in unique_splits:
+        ticker = split_info.get('ticker', 'N/A')
+        k = seen_per_ticker[ticker] = seen_per_ticker.get(ticker, -1) + 1
+        if k == len(rounds): rounds.append([])
+        rounds[k].append(split_info)
+    return [r[i:i + batch_size] for r in rounds for i in range(0, len(r), batch_size)]
+
+async def _one_batch(model, split_batch, sem):
+    """
+    Sends one sub-batch to Gemini (holding a concurrency slot, off the event loop) and parses the reply.
+    Returns {(ticker, canonical ratio): classification_string}.
+    """
+    full_prompt, tickers_sent_list = _build_prompt(split_batch)
+    try:
+        generation_config = {'temperature': config.AI_REQUEST_TEMPERATURE} # Use temp from config
+        async with sem:
+            print(f"Sending batch request (Simple Question Format) to Gemini for {len(tickers_sent_list)} unique tickers...")
+            log_timestamp = datetime.datetime.now().isoformat()
+            # Sync call on a worker thread: genai's async gRPC client binds to the first event loop it runs on,
+            # so under --serve (a fresh asyncio.run per cycle) generate_content_async fails with "Event loop is closed"
+            response = await asyncio.to_thread(model.generate_content, full_prompt, generation_config=generation_config)
+        response_text = response.text
+        print(f"  Received response from Gemini. Logging raw text...")
+        # Log using the list of unique tickers sent
+        log_ai_response(config.AI_LOG_FILE_PATH, log_timestamp, tickers_sent_list, response_text)
+    except Exception as e:
+        _report_api_error(e)
+        return {_split_identity(s): "AI API Error" for s in split_batch}
+    # Tickers are unique within a batch (_plan_batches), so each answer maps back to exactly one split
+    results_by_ticker = _parse_ai_response(response_text, tickers_sent_list)
+    return {_split_identity(s): results_by_ticker.get(s.get('ticker', 'N/A'), "AI Response Missing") for s in split_batch}
+
+
+# --- REVERTED get_batch_ai_validation FOR SIMPLE QUESTION PROMPT (BATCH) ---
+async def get_batch_ai_validation_async(reverse_split_list):
+    """
+    Sends uncached splits to Gemini in sub-batches of AI_MAX_BATCH, up to AI_MAX_CONCURRENCY in flight at once.
+    Returns classification {(ticker, ratio): classification_string}. Logs raw responses.
+    """
+    if not _GEMINI_API_KEY_CONFIGURED: return {}
+    if not reverse_split_list: return {}
+
+    # --- Serve already-classified splits from the cache, only query the rest ---
+    cached_hits = {}
+    to_query = []
+    for split_info in reverse_split_list:
+        cached_result = get_cached_classification(split_info)
+        if cached_result is not None:
+            cached_hits[(split_info.get('ticker', 'N/A'), split_info.get('ratio', 'N/A'))] = cached_result
+        else:
+            to_query.append(split_info)
+    if cached_hits:
+        print(f"Using cached AI classification for {len(cached_hits)} tickers.")
+    if not to_query: return cached_hits
+    # One question per unique (ticker, canonical ratio); the answers are mapped back to every split below
+    unique_splits = {}
+    for split_info in to_query: unique_splits.setdefault(_split_identity(split_info), split_info)
+    # Sort by identity so the dynamic tail is deterministic between runs
+    reverse_split_list = [unique_splits[k] for k in sorted(unique_splits, key=lambda k: (str(k[0]), str(k[1])))]
+
+    genai = _ensure_gemini()
+    if genai is None:
+        ai_results_map = {(s.get('ticker', 'N/A'), s.get('ratio', 'N/A')): "AI API Error" for s in to_query}
+        ai_results_map.update(cached_hits)
+        return ai_results_map
+    model = genai.GenerativeModel(config.AI_MODEL_NAME)
+    split_batches = _plan_batches(reverse_split_list, config.AI_MAX_BATCH)
+    # Bound requests in flight so large lists don't burst past Gemini's per-minute quota
+    sem = asyncio.Semaphore(config.AI_MAX_CONCURRENCY)
+    batch_results = await asyncio.gather(*(_one_batch(model, b, sem) for b in split_batches))
+
+    results_by_identity = {}
+    for result_map in batch_results: results_by_identity.update(result_map)
+    # Map will store {(ticker, ratio): classification_string}, one entry per split as the caller spelled it
+    ai_results_map = {}
+    for split_info in to_query:
+        ai_results_map[(split_info.get('ticker', 'N/A'), split_info.get('ratio', 'N/A'))] = results_by_identity.get(
+            _split_identity(split_info), "AI Response Missing")
+
+    # --- Store definitive classifications for future runs (errors, unclear and 'Unable to Determine' are retried) ---
+    if _cache is not None:
+        try:
+            for split_info in to_query:
+                result = results_by_identity.get(_split_identity(split_info))
+                if result in config.DEFINITIVE_PHRASES:
+                    entry = {'result': result, 'ts': time.time(), 'ex_date': split_info.get('ex_date')}
+                    for key in (_cache_key(split_info), _structural_key(split_info)): _cache[key] = _cache_memo[key] = entry
+            _cache.sync()
+        except Exception as e: print(f"Warning: Could not update AI cache: {e}")
+
+    ai_results_map.update(cached_hits)
+    return ai_results_map # Returns {(ticker, ratio): classification_string}
+
+def get_batch_ai_validation(reverse_split_list):
+    """Synchronous wrapper around get_batch_ai_validation_async for existing callers."""
+    return asyncio.run(get_batch_ai_validation_async(reverse_split_list))
@@ -1,6 +1,7 @@
 # config.py
 """Configuration settings and constants."""
 import os
+import sys
 # Removed By import as it's not needed without Google search selectors
 # from selenium.webdriver.common.by import By
 
@@ -8,20 +9,63 @@ import os
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 # Final output CSV path
 FINAL_CSV_FILE_PATH = os.path.join(BASE_DIR, 'analyzed_upcoming_splits.csv')
+# Optional Parquet copy of the final output (needs pandas + pyarrow); written alongside the CSV
+SAVE_PARQUET = False
+FINAL_PARQUET_FILE_PATH = os.path.join(BASE_DIR, 'analyzed_upcoming_splits.parquet')
+# Optional append-only CSV that accumulates every run's results (the final CSV above is overwritten each run)
+APPEND_CSV_HISTORY = False
+HISTORY_CSV_FILE_PATH = os.path.join(BASE_DIR, 'analyzed_splits_history.csv')
 # Log for raw AI responses
 AI_LOG_FILE_PATH = os.path.join(BASE_DIR, 'gemini_api_raw_responses.jsonl')
 # History file (optional for potential future notification integration)
 HISTORY_FILE_PATH = os.path.join(BASE_DIR, 'notified_splits_history.log')
+# Persistent cache of yfinance exchange lookups (JSON)
+EXCHANGE_CACHE_PATH = os.path.join(BASE_DIR, 'exchange_cache.json')
+# Persistent cache of AI classifications keyed by Ticker|Ratio|ExDate (shelve db)
+AI_CACHE_PATH = os.path.join(BASE_DIR, 'ai_results_cache')
+# SHA-256 of the last fully processed scrape; an identical table on the same day skips the run
+SCRAPE_HASH_PATH = os.path.join(BASE_DIR, 'last_scrape.sha256')
 
 
 # --- AI Configuration ---
 AI_MODEL_NAME = 'gemini-1.5-flash-latest' # Or your preferred model
 AI_REQUEST_TEMPERATURE = 0.2 # Lower temp for more focused response
+AI_MAX_BATCH = 10 # Max splits per Gemini prompt; larger lists are sent as concurrent sub-batches
+AI_MAX_CONCURRENCY = 4 # Sub-batch requests in flight at once (keep within the API key's requests-per-minute quota)
+AI_VERBOSE_ERRORS = False # Print full tracebacks on Gemini API errors
+AI_CACHE_ENABLED = True # Reuse prior classifications instead of re-asking Gemini
+AI_CACHE_TTL_DAYS = 30 # Re-ask Gemini about a split once its cached answer is older than this
+AI_SAME_SPLIT_WINDOW_DAYS = 21 # Same ticker+ratio with ex-dates this close counts as one announcement (reuses its answer)
+AI_SKIP_NOTIFIED = True # Don't re-ask Gemini about splits already sent to Discord when the last run's CSV still has their classification
 
 # --- Scraping Configuration ---
+SKIP_UNCHANGED_SCRAPE = True # Stop early when the scraped table matches the last complete run (same day)
+USE_SELENIUM = False # False: try a plain HTTP fetch first, only launch Chrome if the table isn't server-rendered
+# Optional JSON endpoint the splits page loads its table from (see the browser's network tab); tried first when set
+SPLIT_API_URL = None
+# JSON field name for each table column position, so the *_IDX settings below still apply (unused for row arrays)
+SPLIT_API_COLUMNS = [] # e.g. ['symbol', 'exchange', 'name', 'ratio', 'exDate']
 SELENIUM_WAIT_TIME = 30 # Seconds to wait for initial table elements
+# Persistent Chrome profile reused across runs (warm HTTP cache/DNS/TLS); None for a fresh profile each run.
+# Kept in the user's cache dir (not the source tree) so it's never committed or shipped with the code
+if os.name == 'nt': _USER_CACHE_DIR = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+elif sys.platform == 'darwin': _USER_CACHE_DIR = os.path.expanduser('~/Library/Caches')
+else: _USER_CACHE_DIR = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+CHROME_PROFILE_DIR = os.path.join(_USER_CACHE_DIR, 'stock_split_bot', 'chrome_profile')
+CHROME_DISK_CACHE_SIZE = 64 * 1024 * 1024 # Bytes
+# Attach to an already-running Chrome instead of launching one per run, e.g. one kept alive with
+#   chrome --headless --remote-debugging-port=9222 --user-data-dir=/tmp/chrome-bot
+# and CHROME_DEBUGGER_ADDR=127.0.0.1:9222 in the environment. None launches Chrome as usual.
+CHROME_DEBUGGER_ADDRESS = os.environ.get('CHROME_DEBUGGER_ADDR')
+# --- Exchange Lookup ---
+EXCHANGE_LOOKUP_WORKERS = 16 # Concurrent yfinance lookups in get_exchanges
+EXCHANGE_CACHE_TTL_DAYS = 30 # Listings rarely change; refresh cached exchanges after this
+# --- Notification History ---
+HISTORY_KEEP_PAST_DAYS = 7 # Drop history keys whose ex-date is older than this (past splits are never re-notified)
 # --- Discord Rate Limit ---
-DISCORD_RATE_LIMIT_DELAY = 2.0
+DISCORD_RATE_LIMIT_DELAY = 2.0 # Seconds a send slot waits after a post when Discord sends no rate-limit headers
+DISCORD_CONCURRENCY = 4 # Webhook posts in flight at once (also the keep-alive pool size)
+DISCORD_REQUESTS_PER_SECOND = 2.5 # Steady webhook post rate (Discord allows about 5 per 2 s per webhook)
 
 # --- Table Column Indices ---
 # !!! VERIFY THESE INDICES based on the target website's table structure !!!
@@ -36,4 +80,11 @@ EXCHANGE_IDX = None # e.g., 1 if it's the second column
 OUTPUT_ROUND_UP = "Rounding Up Likely"
 OUTPUT_CASH = "Cash-in-Lieu Likely"
 OUTPUT_UNKNOWN = "Unable to Determine"
-CLASSIFICATION_PHRASES = [OUTPUT_ROUND_UP, OUTPUT_CASH, OUTPUT_UNKNOWN]
\ No newline at end of file
+CLASSIFICATION_PHRASES = [OUTPUT_ROUND_UP, OUTPUT_CASH, OUTPUT_UNKNOWN]
+DEFINITIVE_PHRASES = [OUTPUT_ROUND_UP, OUTPUT_CASH] # Answers worth caching/reusing; OUTPUT_UNKNOWN is asked again next run
+
+# --- Deterministic Ratio Rules (checked before the cache/Gemini; empty = opt-in, nothing is inferred automatically) ---
+# Canonical ratio ('1:10') -> an output phrase, or a callable(split_info) returning a phrase or None.
+# split_info has 'ticker', 'ratio', 'ex_date' and 'exchange'. OUTPUT_UNKNOWN/None falls through to Gemini.
+# e.g. {'1:50': lambda s: OUTPUT_CASH if s.get('exchange') in ('NYSE', 'NASDAQ') else None}
+AI_RATIO_RULES = {}
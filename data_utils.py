@@ -1,21 +1,84 @@
 # data_utils.py
 """Utility functions for data validation and external lookups."""
 
-import yfinance as yf
 import requests
+import re
+import json
 import time
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import os
+import config # Import constants
 
-# Cache for yfinance lookups within a single run
-exchange_cache = {}
+# Optional: orjson (de)serializes the exchange cache faster than stdlib json (same file format)
+try:
+    import orjson
+    def _json_loads(raw): return orjson.loads(raw)
+    def _json_dumps(obj): return orjson.dumps(obj)
+except ImportError:
+    def _json_loads(raw): return json.loads(raw)
+    def _json_dumps(obj): return json.dumps(obj, ensure_ascii=False).encode('utf-8')
 
-def get_exchange_cached(ticker):
-    """Fetches stock exchange from yfinance, using a simple cache."""
-    if ticker in exchange_cache:
-        return exchange_cache[ticker]
+# Cache for yfinance lookups, persisted across runs ({ticker: {"exchange": ..., "ts": epoch}})
+_EXCHANGE_CACHE_TTL = config.EXCHANGE_CACHE_TTL_DAYS * 86400
+_exchange_cache_lock = threading.Lock()
+_exchange_cache_dirty = False # Set when a lookup adds/refreshes an entry; unchanged caches aren't rewritten
+
+def _load_exchange_cache(filepath=config.EXCHANGE_CACHE_PATH):
+    """Loads non-expired exchange lookups saved by previous runs."""
+    cache = {}
+    try:
+        if os.path.exists(filepath):
+            with open(filepath, 'rb') as f:
+                saved = _json_loads(f.read())
+            now = time.time()
+            cache = {t: e for t, e in saved.items() if now - e.get('ts', 0) < _EXCHANGE_CACHE_TTL}
+            print(f"Loaded {len(cache)} cached exchange lookups from '{filepath}'.")
+    except Exception as e:
+        print(f"Warning: Could not load exchange cache from {filepath}: {e}")
+    return cache
+
+def _flush_exchange_cache(filepath=config.EXCHANGE_CACHE_PATH):
+    """Writes successful exchange lookups back to disk atomically (failed lookups are retried next run)."""
+    global _exchange_cache_dirty
+    with _exchange_cache_lock:
+        if not _exchange_cache_dirty: return # Every ticker was served from the loaded cache
+        _exchange_cache_dirty = False
+        to_save = {t: e for t, e in exchange_cache.items() if not e['exchange'].startswith('Lookup Failed')}
+    try:
+        dir_name = os.path.dirname(filepath)
+        if dir_name: os.makedirs(dir_name, exist_ok=True)
+        tmp_path = filepath + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(_json_dumps(to_save))
+        os.replace(tmp_path, filepath)
+    except Exception as e:
+        print(f"Warning: Could not save exchange cache to {filepath}: {e}")
+
+exchange_cache = _load_exchange_cache()
+atexit.register(_flush_exchange_cache) # Backstop for lookups made outside get_exchanges (get_exchange_cached)
+
+def _cached_exchange(ticker):
+    """Returns the cached exchange for a ticker, or None if missing/expired."""
+    entry = exchange_cache.get(ticker)
+    if entry and time.time() - entry['ts'] < _EXCHANGE_CACHE_TTL:
+        return entry['exchange']
+    return None
+
+def _cache_exchange(ticker, exchange):
+    """Stores a lookup result in the shared cache (thread-safe) and returns it."""
+    global _exchange_cache_dirty
+    with _exchange_cache_lock:
+        exchange_cache[ticker] = {'exchange': exchange, 'ts': time.time()}
+        _exchange_cache_dirty = True
+    return exchange
 
+def _lookup_one(ticker):
+    """Fetches stock exchange for a single ticker from yfinance and caches the result."""
     print(f"  Looking up exchange for {ticker} via yfinance...")
     try:
+        import yfinance as yf # Lazy: most runs are served from the persisted cache
         stock = yf.Ticker(ticker)
         info = stock.info
         exchange = info.get('exchange')
@@ -23,42 +86,77 @@ def get_exchange_cached(ticker):
             exchange_map = { "NMS": "NASDAQ", "NYQ": "NYSE", "ASE": "NYSE AMEX", "PNK": "OTC Pink", "OQB": "OTCQB", "OTCQX": "OTCQX", "TOR": "TSX", "VAN": "TSX-V" }
             mapped_exchange = exchange_map.get(exchange, exchange)
             print(f"    -> Found exchange: {mapped_exchange}")
-            exchange_cache[ticker] = mapped_exchange
-            return mapped_exchange
+            return _cache_exchange(ticker, mapped_exchange)
         else:
             quote_type = info.get('quoteType')
             if quote_type == 'ETF' and info.get('market') and 'us_market' in info.get('market'):
                  print(f"    -> Found ETF market (assumed US): {info.get('market')}")
-                 exchange_cache[ticker] = "US ETF Market"
-                 return "US ETF Market"
+                 return _cache_exchange(ticker, "US ETF Market")
             print(f"    -> Exchange info not found for {ticker} in yfinance data.")
-            exchange_cache[ticker] = 'N/A'
-            return 'N/A'
+            return _cache_exchange(ticker, 'N/A')
     except requests.exceptions.HTTPError as http_err:
         if http_err.response.status_code == 404: print(f"    -> Ticker {ticker} not found on Yahoo Finance (404 Error).")
         else: print(f"    -> HTTP error looking up {ticker}: {http_err}")
-        exchange_cache[ticker] = 'Lookup Failed (HTTP)'
-        return 'Lookup Failed (HTTP)'
+        return _cache_exchange(ticker, 'Lookup Failed (HTTP)')
     except Exception as e:
         print(f"    -> Error looking up exchange for {ticker}: {type(e).__name__}")
-        exchange_cache[ticker] = 'Lookup Failed'
-        return 'Lookup Failed'
-    time.sleep(0.2) # Small delay between lookups
+        return _cache_exchange(ticker, 'Lookup Failed')
+
+def get_exchange_cached(ticker):
+    """Fetches stock exchange from yfinance, using a simple cache."""
+    cached = _cached_exchange(ticker)
+    if cached is not None:
+        return cached
+    return _lookup_one(ticker)
+
+def get_exchanges(tickers):
+    """
+    Fetches exchanges for many tickers at once, running uncached lookups concurrently.
+    Returns {ticker: exchange} for every requested ticker.
+    """
+    to_lookup = [t for t in dict.fromkeys(tickers) if t and _cached_exchange(t) is None]
+    if to_lookup:
+        print(f"Looking up exchange for {len(to_lookup)} tickers ({config.EXCHANGE_LOOKUP_WORKERS} workers)...")
+        # Lookups are network-bound, so threads overlap the HTTP round-trips
+        with ThreadPoolExecutor(max_workers=config.EXCHANGE_LOOKUP_WORKERS) as executor:
+            list(executor.map(_lookup_one, to_lookup))
+        # Persist now rather than only at exit: --serve keeps the process alive for days, and a crash would lose them
+        _flush_exchange_cache()
+    return {t: _cached_exchange(t) or 'Lookup Failed' for t in tickers if t}
+
+
+# "<number> <: or / or -for-> <number>" with optional whitespace; captures both numbers
+_RATIO_RE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*(?::|/|-for-)\s*(\d+(?:\.\d+)?)\s*$', re.IGNORECASE | re.ASCII)
+
+def normalize_ratio(ratio_str):
+    """Normalizes '1-for-10', '1/10', ' 1 : 10 ' etc. to the canonical '1:10' form (None if unparseable)."""
+    if not isinstance(ratio_str, str): return None
+    m = _RATIO_RE.match(ratio_str)
+    if not m: return None
+    return f"{float(m.group(1)):g}:{float(m.group(2)):g}"
 
 
 def is_reverse_split(ratio_str):
     """Checks if a ratio string represents a reverse split."""
-    try:
-        if not isinstance(ratio_str, str) or not ratio_str: return False
-        ratio_str = ratio_str.strip()
-        parts = []
-        if ':' in ratio_str: parts = ratio_str.split(':')
-        elif '/' in ratio_str: parts = ratio_str.split('/')
-        elif '-for-' in ratio_str.lower(): parts = ratio_str.lower().split('-for-')
-        else: return False
-        if len(parts) != 2: return False
-        part1 = float(parts[0].strip())
-        part2 = float(parts[1].strip())
-        return part1 < part2
-    except (ValueError, IndexError, TypeError):
-        return False
\ No newline at end of file
+    if not isinstance(ratio_str, str): return False
+    m = _RATIO_RE.match(ratio_str)
+    if not m: return False
+    left, right = m.groups()
+    if '.' in left or '.' in right: return float(left) < float(right)
+    # Plain integer ratios: compare digit strings without float()
+    left, right = left.lstrip('0'), right.lstrip('0')
+    return len(left) < len(right) or (len(left) == len(right) and left < right)
+
+
+def are_reverse_splits(ratios):
+    """
+    Vectorized is_reverse_split: takes a pandas Series of ratio strings and
+    returns a NumPy bool array (True where the ratio is a reverse split).
+    """
+    import pandas as pd # Lazy: only needed once there are rows to classify
+    ratios = pd.Series(ratios, dtype=object)
+    if ratios.empty: return ratios.to_numpy(dtype=bool)
+    # astype(str) instead of a per-row isinstance check: None/NaN/numbers become strings the regex can't match.
+    # Both groups are plain decimals, so unmatched rows (NaN) and matches convert with one astype(float).
+    parts = ratios.astype(str).str.extract(_RATIO_RE).astype(float)
+    return (parts[0] < parts[1]).to_numpy(dtype=bool)
@@ -2,14 +2,52 @@
 """Handles sending notifications to Discord."""
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import asyncio
+import atexit
 import datetime
+import json
 import time
 import config # Import constants
 
-def send_discord_notification(webhook_url, split_data):
-    """Sends an embed message to Discord, including the Exchange."""
-    if not webhook_url: return False
-    headers = {"Content-Type": "application/json"}
+# Optional: orjson encodes payloads to bytes faster than stdlib json (same wire format)
+try:
+    import orjson
+    _encode_payload = orjson.dumps
+except ImportError:
+    def _encode_payload(obj): return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+# Discord accepts at most this many embeds in a single webhook message
+DISCORD_MAX_EMBEDS = 10
+# ...and at most this many characters across all embed titles, field names/values and footers
+DISCORD_MAX_EMBED_CHARS = 6000
+
+# Shared keep-alive session so consecutive posts reuse one TCP+TLS connection.
+# Retries 429 with backoff (honouring Retry-After); POST must be allowed explicitly. Only 429 and connect errors are
+# retried: Discord guarantees a rate-limited or unsent POST wasn't posted, while after a 5xx or read timeout the message
+# may already be in the channel and a replay would post it twice.
+# Once retries run out the last response is returned so raise_for_status reports Discord's status code.
+_session = requests.Session()
+_session.headers.update({"Content-Type": "application/json"})
+_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=config.DISCORD_CONCURRENCY, max_retries=Retry(
+    total=3, read=0, backoff_factor=0.5, status_forcelist=[429], allowed_methods=frozenset({"POST"}),
+    respect_retry_after_header=True, raise_on_status=False)))
+atexit.register(_session.close)
+
+# Parts of every embed that don't depend on the split (shared, never mutated -- only serialized)
+_EMBED_TEMPLATE = {
+    "title": "📈 Upcoming Stock Split Alert",
+    "color": 3447003, # Discord Blue
+    "footer": {"text": "Source: Automated Stock Split Script"},
+}
+
+def _utc_timestamp():
+    """Current UTC time as the ISO string Discord expects (second precision is all it displays)."""
+    return datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+
+def _make_embed(split_data, timestamp=None):
+    """Builds the Discord embed dict for one split, including the Exchange. Pass timestamp to share one across a batch."""
     fields = [
         {"name": "Ticker", "value": split_data.get('Ticker', 'N/A'), "inline": True},
         {"name": "Exchange", "value": split_data.get('Exchange', 'N/A'), "inline": True},
@@ -20,23 +58,99 @@ def send_discord_notification(webhook_url, split_data):
         # Optionally add AI Reasoning field here if desired, maybe truncated
         # {"name": "AI Reasoning", "value": split_data.get('ai_reasoning', 'N/A')[:1000], "inline": False}
     ]
-    payload = {
-        "embeds": [{
-            "title": "📈 Upcoming Stock Split Alert",
-            "color": 3447003, # Discord Blue
-            "fields": fields,
-            "footer": {"text": "Source: Automated Stock Split Script"},
-            "timestamp": datetime.datetime.utcnow().isoformat()
-        }]
-    }
+    return {**_EMBED_TEMPLATE, "fields": fields, "timestamp": timestamp or _utc_timestamp()}
+
+def _rate_limit_wait(headers):
+    """Seconds to pause before the next post, from Discord's rate-limit headers (fixed delay if absent)."""
+    remaining, reset_after = headers.get("X-RateLimit-Remaining"), headers.get("X-RateLimit-Reset-After")
+    try:
+        if remaining is not None and reset_after is not None:
+            return float(reset_after) if int(remaining) <= 0 else 0.0
+    except ValueError: pass
+    return config.DISCORD_RATE_LIMIT_DELAY
+
+def _post_embeds(webhook_url, embeds, label):
+    """POSTs a list of embeds as one webhook message. Returns (success, seconds to wait before the next post)."""
+    payload = {"embeds": embeds}
     try:
-        response = requests.post(webhook_url, headers=headers, json=payload, timeout=15)
+        # Pre-encoded body; the session already sends Content-Type: application/json
+        response = _session.post(webhook_url, data=_encode_payload(payload), timeout=15)
         response.raise_for_status()
-        print(f"  Successfully sent Discord notification for {split_data.get('Ticker', 'N/A')}")
-        return True
+        print(f"  Successfully sent Discord notification for {label}")
+        return True, _rate_limit_wait(response.headers)
     except requests.exceptions.RequestException as e:
-        print(f"Error sending Discord notification for {split_data.get('Ticker', 'N/A')}: {e}")
-        return False
+        print(f"Error sending Discord notification for {label}: {e}")
+        return False, config.DISCORD_RATE_LIMIT_DELAY
     except Exception as e:
-        print(f"Unexpected error during Discord notification for {split_data.get('Ticker', 'N/A')}: {e}")
-        return False
\ No newline at end of file
+        print(f"Unexpected error during Discord notification for {label}: {e}")
+        return False, config.DISCORD_RATE_LIMIT_DELAY
+
+def send_discord_notification(webhook_url, split_data):
+    """Sends an embed message to Discord, including the Exchange."""
+    if not webhook_url: return False
+    return _post_embeds(webhook_url, [_make_embed(split_data)], split_data.get('Ticker', 'N/A'))[0]
+
+def _embed_chars(embed):
+    """Characters Discord counts toward the per-message embed limit."""
+    return (len(embed.get("title", "")) + len(embed.get("footer", {}).get("text", ""))
+            + sum(len(str(f["name"])) + len(str(f["value"])) for f in embed.get("fields", [])))
+
+def _chunk_splits(split_list):
+    """Groups splits into (splits, embeds) messages within Discord's embed count and size limits."""
+    chunks, splits, embeds, chars = [], [], [], 0
+    timestamp = _utc_timestamp() # One timestamp for the whole batch
+    for split_data in split_list:
+        embed = _make_embed(split_data, timestamp)
+        size = _embed_chars(embed)
+        if embeds and (len(embeds) == DISCORD_MAX_EMBEDS or chars + size > DISCORD_MAX_EMBED_CHARS):
+            chunks.append((splits, embeds))
+            splits, embeds, chars = [], [], 0
+        splits.append(split_data); embeds.append(embed); chars += size
+    if embeds: chunks.append((splits, embeds))
+    return chunks
+
+class _TokenBucket:
+    """Async token bucket: up to `capacity` posts back-to-back, then `rate` posts per second."""
+    def __init__(self, rate, capacity):
+        self.rate, self.capacity = rate, capacity
+        self.tokens, self.updated = float(capacity), time.monotonic()
+        self.lock = asyncio.Lock() # Waiters queue here in order while one sleeps for the next token
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+async def _post_chunk(sem, bucket, webhook_url, chunk, embeds):
+    """Posts one chunk of splits while holding a concurrency slot and a rate token. Returns the chunk if sent, else []."""
+    async with sem:
+        await bucket.acquire() # Proactive throttle, so bursts don't rely on 429 retries
+        label = ", ".join(s.get('Ticker', 'N/A') for s in chunk)
+        # requests is blocking, so the POST runs on a worker thread over the shared session
+        ok, wait = await asyncio.to_thread(_post_embeds, webhook_url, embeds, label)
+        # Only hold the slot when Discord says the bucket is empty (429s are retried by the adapter via Retry-After)
+        if wait: await asyncio.sleep(wait)
+        return chunk if ok else []
+
+async def _send_all(webhook_url, chunks):
+    """Sends all chunks concurrently, bounded by DISCORD_CONCURRENCY and DISCORD_REQUESTS_PER_SECOND."""
+    sem = asyncio.Semaphore(config.DISCORD_CONCURRENCY)
+    bucket = _TokenBucket(config.DISCORD_REQUESTS_PER_SECOND, config.DISCORD_CONCURRENCY)
+    return await asyncio.gather(*(_post_chunk(sem, bucket, webhook_url, c, e) for c, e in chunks))
+
+def send_discord_notifications_batch(webhook_url, split_list):
+    """
+    Sends splits as multi-embed webhook messages (up to 10 embeds / 6000 characters per POST),
+    with up to DISCORD_CONCURRENCY messages in flight at once.
+    Returns the list of splits that were sent successfully.
+    """
+    if not webhook_url or not split_list: return []
+    sent = []
+    for sent_chunk in asyncio.run(_send_all(webhook_url, _chunk_splits(split_list))): sent.extend(sent_chunk)
+    return sent
@@ -1,12 +1,39 @@
 # file_handler.py
-"""Functions for reading and writing data to files (CSV)."""
+"""Functions for reading and writing data to files (CSV, optional Parquet)."""
 import json # Keep json import if using log_ai_response from ai_handler
-import pandas as pd
+import csv
+import datetime
+import hashlib
 import os
 import config # Import constants
 
 # --- save_to_json and load_from_json REMOVED as main script doesn't use them ---
 
+# Preferred output column order; also the fixed layout of the append-only CSV history
+OUTPUT_COLUMNS = ['scrape_timestamp', 'Ticker', 'Exchange', 'CompanyName', 'Ratio', 'ExDate', 'fractional_share_handling']
+
+# Low-cardinality output columns stored as pandas categoricals in the Parquet output
+# (dictionary-encoded on disk, read back as category dtype)
+CATEGORY_COLUMNS = ('Ticker', 'Exchange', 'fractional_share_handling')
+
+# Text-file buffer for the CSV writers: rows are flushed to disk in large chunks, not per line
+_WRITE_BUFFER_SIZE = 1 << 20
+
+def _output_columns(data):
+    """Returns (ordered column names, timestamp to fill in or None) shared by the CSV and Parquet writers."""
+    columns = list(dict.fromkeys(key for record in data for key in record))
+    # Add timestamp if not already present
+    now_ts = None
+    if 'scrape_timestamp' not in columns:
+         now_ts = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+         # Insert timestamp at the beginning for better visibility
+         columns.insert(0, 'scrape_timestamp')
+
+    # Ensure only existing columns are selected and ordered
+    final_cols = [col for col in OUTPUT_COLUMNS if col in columns]
+    extra_cols = [col for col in columns if col not in final_cols] # Keep any unexpected extra cols
+    return final_cols + extra_cols, now_ts
+
 def save_to_csv(data, filepath=config.FINAL_CSV_FILE_PATH):
     """Saves a list of dictionaries to a CSV file."""
     if not data:
@@ -14,25 +41,100 @@ def save_to_csv(data, filepath=config.FINAL_CSV_FILE_PATH):
         return False
     print(f"Attempting to save {len(data)} records to CSV '{filepath}'...")
     try:
-        df = pd.DataFrame(data)
-        # Add timestamp if not already present
-        if 'scrape_timestamp' not in df.columns:
-             now_ts = pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S')
-             # Insert timestamp at the beginning for better visibility
-             df.insert(0, 'scrape_timestamp', now_ts)
-
-        # Define desired column order (adjust as needed)
-        desired_cols = ['scrape_timestamp', 'Ticker', 'Exchange', 'CompanyName', 'Ratio', 'ExDate', 'fractional_share_handling']
-        # Ensure only existing columns are selected and ordered
-        final_cols = [col for col in desired_cols if col in df.columns]
-        extra_cols = [col for col in df.columns if col not in final_cols] # Keep any unexpected extra cols
-        df = df[final_cols + extra_cols]
-
+        columns, now_ts = _output_columns(data)
         dir_name = os.path.dirname(filepath)
         if dir_name: os.makedirs(dir_name, exist_ok=True)
-        df.to_csv(filepath, index=False, encoding='utf-8')
+        # Stream records straight to disk; missing keys are written as empty cells
+        with open(filepath, 'w', buffering=_WRITE_BUFFER_SIZE, newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=columns, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(({**record, 'scrape_timestamp': now_ts} for record in data) if now_ts else data)
         print(f"Successfully saved data to {filepath}")
         return True
     except Exception as e:
         print(f"Error: Could not save data to CSV '{filepath}': {e}")
-        return False
\ No newline at end of file
+        return False
+
+def append_to_csv(data, filepath=config.HISTORY_CSV_FILE_PATH):
+    """Appends records to a running CSV history (header written only when the file is new)."""
+    if not data:
+        print("No data provided to append to CSV history.")
+        return False
+    print(f"Appending {len(data)} records to CSV history '{filepath}'...")
+    try:
+        # Fixed columns so every run's rows line up under the header written by the first run
+        now_ts = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        dir_name = os.path.dirname(filepath)
+        if dir_name: os.makedirs(dir_name, exist_ok=True)
+        with open(filepath, 'a', buffering=_WRITE_BUFFER_SIZE, newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=OUTPUT_COLUMNS, extrasaction='ignore')
+            if f.tell() == 0: writer.writeheader()
+            writer.writerows({'scrape_timestamp': now_ts, **record} for record in data)
+        print(f"Successfully appended data to {filepath}")
+        return True
+    except Exception as e:
+        print(f"Error: Could not append data to CSV history '{filepath}': {e}")
+        return False
+
+def save_to_parquet(data, filepath=config.FINAL_PARQUET_FILE_PATH):
+    """Saves a list of dictionaries to a zstd-compressed Parquet file (needs pandas + pyarrow)."""
+    if not data:
+        print("No data provided to save to Parquet.")
+        return False
+    print(f"Attempting to save {len(data)} records to Parquet '{filepath}'...")
+    try:
+        import pandas as pd # Lazy: only needed when Parquet output is enabled
+        columns, now_ts = _output_columns(data)
+        df = pd.DataFrame(data).reindex(columns=columns)
+        if now_ts: df['scrape_timestamp'] = now_ts
+        for col in CATEGORY_COLUMNS:
+            if col in df: df[col] = df[col].astype('category')
+        dir_name = os.path.dirname(filepath)
+        if dir_name: os.makedirs(dir_name, exist_ok=True)
+        df.to_parquet(filepath, engine='pyarrow', compression='zstd', index=False)
+        print(f"Successfully saved data to {filepath}")
+        return True
+    except ImportError as e:
+        print(f"Warning: Parquet output needs pandas and pyarrow ({e}). Skipping Parquet save.")
+        return False
+    except Exception as e:
+        print(f"Error: Could not save data to Parquet '{filepath}': {e}")
+        return False
+
+def scrape_fingerprint(rows, as_of=None):
+    """SHA-256 of the scraped rows plus the date (the future-ex-date filter changes daily)."""
+    as_of = as_of or datetime.date.today().isoformat()
+    return hashlib.sha256(repr((as_of, rows)).encode('utf-8')).hexdigest()
+
+def load_previous_classifications(filepath=config.FINAL_CSV_FILE_PATH):
+    """Returns {(Ticker, ExDate): classification} for definitive classifications in the last run's CSV ({} if none)."""
+    try:
+        with open(filepath, 'r', newline='', encoding='utf-8') as f:
+            return {(row.get('Ticker'), row.get('ExDate')): row['fractional_share_handling'] for row in csv.DictReader(f)
+                    if row.get('fractional_share_handling') in config.DEFINITIVE_PHRASES}
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"Warning: Could not read previous classifications from {filepath}: {e}")
+        return {}
+
+def load_scrape_hash(filepath=config.SCRAPE_HASH_PATH):
+    """Returns the fingerprint saved by the last complete run, or None."""
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Warning: Could not read scrape hash from {filepath}: {e}")
+        return None
+
+def save_scrape_hash(fingerprint, filepath=config.SCRAPE_HASH_PATH):
+    """Records the fingerprint of a fully processed scrape."""
+    try:
+        dir_name = os.path.dirname(filepath)
+        if dir_name: os.makedirs(dir_name, exist_ok=True)
+        with open(filepath, 'w', encoding='utf-8') as f:
+            f.write(fingerprint + '\n')
+    except Exception as e:
+        print(f"Warning: Could not save scrape hash to {filepath}: {e}")
@@ -1,18 +1,42 @@
 # history_manager.py
-"""Manages loading and saving the notification history."""
+"""
+Manages loading and saving the notification history.
+In memory the keys are (ticker, ex_date) tuples; on disk each is one 'Ticker_YYYY-MM-DD' line.
+"""
 
+import datetime
+import mmap
 import os
 import config # Import constants
 
+def _format_key(key):
+    """(ticker, ex_date) -> the 'Ticker_ExDate' line stored on disk."""
+    return f"{key[0]}_{key[1]}"
+
+def _history_cutoff():
+    """Ex-date (YYYY-MM-DD) before which history keys can be dropped."""
+    return (datetime.date.today() - datetime.timedelta(days=config.HISTORY_KEEP_PAST_DAYS)).isoformat()
+
 def load_notified_history(filepath=config.HISTORY_FILE_PATH):
-    """Loads previously notified split keys (Ticker_ExDate) from a file."""
+    """Loads previously notified split keys as (ticker, ex_date) tuples from a file, skipping long-past ex-dates."""
     notified = set()
     try:
         if os.path.exists(filepath):
-            with open(filepath, 'r', encoding='utf-8') as f:
-                for line in f:
-                    key = line.strip()
-                    if key: notified.add(key)
+            # Map the file and split the bytes in C instead of a per-line Python loop
+            # (mmap can't map an empty file, hence the size check)
+            with open(filepath, 'rb') as f:
+                if os.fstat(f.fileno()).st_size:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        raw = mm[:].decode('utf-8', 'replace')
+                else:
+                    raw = ''
+            # Only future ex-dates are ever notified, so keys for long-past splits are dead weight;
+            # lines are Ticker_YYYY-MM-DD, so the split-off date compares correctly as a string
+            cutoff = _history_cutoff()
+            # Lines without a '_' (e.g. a bare legacy 'NODATE') can't be a Ticker_ExDate key and are dropped,
+            # so a later rewrite can't turn them into '_NODATE'
+            keys = ((ticker, ex_date) for ticker, sep, ex_date in (line.strip().rpartition('_') for line in raw.splitlines()) if sep)
+            notified = {key for key in keys if key[1] and not (key[1] < cutoff and key[1][:4].isdigit())}
             print(f"Loaded {len(notified)} entries from notification history '{filepath}'.")
         else:
             print(f"Notification history file '{filepath}' not found. Starting fresh.")
@@ -26,10 +50,34 @@ def save_notified_history(notified_set, filepath=config.HISTORY_FILE_PATH):
     try:
         dir_name = os.path.dirname(filepath)
         if dir_name: os.makedirs(dir_name, exist_ok=True)
-        with open(filepath, 'w', encoding='utf-8') as f:
-            # Save sorted list for better readability and diffing
-            for key in sorted(list(notified_set)):
-                f.write(key + '\n')
+        # Save sorted list for better readability and diffing, joined into one buffer/write
+        buf = "".join(_format_key(key) + '\n' for key in sorted(notified_set)).encode('utf-8')
+        # Write to a temp file and swap it in so an interrupted save can't truncate history
+        tmp_path = filepath + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(buf)
+            # Make the bytes durable before the rename, or a crash could leave an empty file under the final name
+            f.flush(); os.fsync(f.fileno())
+        os.replace(tmp_path, filepath)
         print(f"Successfully saved notification history to {filepath}")
     except Exception as e:
-        print(f"Error: Could not save notification history to {filepath}: {e}")
\ No newline at end of file
+        print(f"Error: Could not save notification history to {filepath}: {e}")
+
+def append_notified_history(new_keys, all_keys, filepath=config.HISTORY_FILE_PATH):
+    """
+    Appends only newly notified keys to the history file (O(new) instead of rewriting everything).
+    Compacts by rewriting the sorted full set if the file has grown past twice its expected size.
+    """
+    if not new_keys: return
+    print(f"Appending {len(new_keys)} new entries to notification history '{filepath}'...")
+    try:
+        dir_name = os.path.dirname(filepath)
+        if dir_name: os.makedirs(dir_name, exist_ok=True)
+        with open(filepath, 'ab') as f:
+            f.write("".join(_format_key(key) + '\n' for key in sorted(new_keys)).encode('utf-8'))
+        expected_size = sum(len(_format_key(key).encode('utf-8')) + 1 for key in all_keys)
+        if os.path.getsize(filepath) > 2 * expected_size:
+            print("Notification history has grown past twice its expected size; compacting...")
+            save_notified_history(all_keys, filepath)
+    except Exception as e:
+        print(f"Error: Could not append to notification history {filepath}: {e}")
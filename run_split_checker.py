@@ -6,134 +6,290 @@ Main script:
 3. Sends batch request to AI for reverse split fractional analysis.
 4. Merges AI results.
 5. Saves final analyzed data to CSV.
+6. Sends Discord notifications for splits not notified before.
 """
-import pandas as pd
+import argparse
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
 import datetime
+from operator import itemgetter
 import time
 import os
+import signal
 import sys
 
 # --- Import configuration and modules ---
 try:
     import main as secrets
     import config
-    from scraper import setup_driver, scrape_split_data
-    from data_utils import get_exchange_cached, is_reverse_split
-    from ai_handler import configure_gemini, get_batch_ai_validation
-    from file_handler import save_to_csv
+    from scraper import get_driver, quit_driver, release_shared_driver, scrape_split_data, fetch_split_data_http, fetch_split_data_api
+    from data_utils import get_exchanges, are_reverse_splits
+    from ai_handler import configure_gemini, get_batch_ai_validation_async, get_cached_classification
+    from file_handler import save_to_csv, append_to_csv, save_to_parquet, scrape_fingerprint, load_scrape_hash, save_scrape_hash, load_previous_classifications
+    from discord_notifier import send_discord_notifications_batch
+    from history_manager import load_notified_history, append_notified_history
 except ImportError as e:
-    exit(f"ERROR: Failed to import necessary module: {e}. Ensure all required .py files are present.")
+    # Reported by main() instead of exiting here, so importing this module never kills the importer
+    _IMPORT_ERROR = e
+else:
+    _IMPORT_ERROR = None
+
+# Diagnostics go through logging (LOG_LEVEL=DEBUG to see them); regular progress output stays on print
+log = logging.getLogger("split_checker")
+
+# Classifications that mean the AI step did not produce an answer (retried on the next run)
+AI_FAILURE_RESULTS = ["AI Response Missing", "AI API Error", "AI Response Unclear", "AI Analysis Failed/Missing"]
+
+def close_driver(driver):
+    """Quits the WebDriver, ignoring errors (safe to call with None)."""
+    if not driver: return
+    print("\nClosing WebDriver...")
+    try: quit_driver(driver)
+    except Exception as quit_err: print(f"Warning: Error closing WebDriver: {quit_err}")
+    print("WebDriver closed.")
+
+def notify_new_splits(webhook_url, records, notified_keys_history, current_run_notified_keys):
+    """Sends Discord notifications for records not notified in a previous run. Returns True if none failed."""
+    # (Ticker, ExDate) keys are built once per record; duplicate rows and splits already sent this run collapse to one entry
+    keyed = {}
+    for r in records: keyed.setdefault((r.get('Ticker', 'UNKNOWN'), r.get('ExDate', 'NODATE')), r)
+    new_keys = keyed.keys() - notified_keys_history - current_run_notified_keys
+    to_notify = [r for key, r in keyed.items() if key in new_keys] # Keeps the table's order
+    if not to_notify: return True
+    print(f"\nSending Discord notifications for {len(to_notify)} new splits ({len(records) - len(to_notify)} already notified or duplicate)...")
+    key_by_record = {id(r): key for key, r in keyed.items()}
+    sent_records = send_discord_notifications_batch(webhook_url, to_notify)
+    current_run_notified_keys.update(key_by_record[id(record)] for record in sent_records)
+    return len(sent_records) == len(to_notify)
 
 # --- Main Execution Logic ---
-if __name__ == "__main__":
+def main(keep_driver=False):
+    """
+    Runs the full scrape -> enrich -> AI -> CSV -> Discord pipeline once.
+    keep_driver leaves Chrome running for the next call (used by serve()).
+    """
+    if _IMPORT_ERROR is not None:
+        sys.exit(f"ERROR: Failed to import necessary module: {_IMPORT_ERROR}. Ensure all required .py files are present.")
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper(), format="%(levelname)s: %(message)s")
     start_time = time.time()
     print(f"--- Starting Stock Split Checker ({datetime.datetime.now():%Y-%m-%d %H:%M:%S}) ---")
 
     driver = None
-    initial_records = []
-    final_analyzed_data = []
+    final_analyzed_data = [] # Records are built once and have AI results filled in place
     reverse_splits_to_analyze = []
     ai_enabled = configure_gemini(secrets.GEMINI_API_KEY)
+    webhook_url = getattr(secrets, 'DISCORD_WEBHOOK_URL', None)
+    notified_keys_history = load_notified_history()
+    current_run_notified_keys = set()
 
     try:
-        driver = setup_driver()
-        if not driver: raise Exception("WebDriver initialization failed.")
-
-        headers, all_row_data_values = scrape_split_data(driver, secrets.URL)
-        print(f"DEBUG: Scraped {len(all_row_data_values)} raw rows from website.") # <-- DEBUG PRINT 1
+        # Cheapest source first: JSON API (if configured), then the served HTML, then headless Chrome
+        http_result = fetch_split_data_api(config.SPLIT_API_URL) if config.SPLIT_API_URL else None
+        if http_result is None and not config.USE_SELENIUM: http_result = fetch_split_data_http(secrets.URL)
+        if http_result is not None:
+            headers, all_row_data_values = http_result
+        else:
+            driver = get_driver(reuse=keep_driver)
+            if not driver: raise Exception("WebDriver initialization failed.")
+            headers, all_row_data_values = scrape_split_data(driver, secrets.URL)
+        log.debug("Scraped %d raw rows from website.", len(all_row_data_values))
         if not all_row_data_values:
             print("No data scraped from the primary source. Exiting.")
             sys.exit()
+        scrape_hash = scrape_fingerprint(all_row_data_values)
+        if config.SKIP_UNCHANGED_SCRAPE and scrape_hash == load_scrape_hash() and os.path.exists(config.FINAL_CSV_FILE_PATH):
+            print("Split table unchanged since the last complete run today. Nothing to do.")
+            sys.exit()
 
         print("\nProcessing scraped rows, filtering dates, getting Exchange...")
+        import pandas as pd # Lazy: not needed on runs that scrape nothing
         today_date = datetime.date.today()
         required_indices = [config.TICKER_IDX, config.COMPANY_NAME_IDX, config.RATIO_IDX, config.EX_DATE_IDX];
         if config.EXCHANGE_IDX is not None: required_indices.append(config.EXCHANGE_IDX)
         MIN_EXPECTED_COLUMNS = max(required_indices) + 1 if required_indices else 1
 
-        for i, row_values in enumerate(all_row_data_values):
-            # ... (row validation and data extraction) ...
-            if not row_values or len(row_values) < MIN_EXPECTED_COLUMNS: continue
-            try:
-                ticker_val = row_values[config.TICKER_IDX]; company_val = row_values[config.COMPANY_NAME_IDX]
-                ratio_val = row_values[config.RATIO_IDX]; ex_date_str = row_values[config.EX_DATE_IDX]
-                exchange_val = row_values[config.EXCHANGE_IDX] if config.EXCHANGE_IDX is not None and config.EXCHANGE_IDX < len(row_values) else None
-            except IndexError: continue
-            if not ticker_val or not ratio_val or not ex_date_str or ex_date_str.upper() == 'N/A': continue
-            ex_date_obj = None
-            try: ex_date_obj = datetime.datetime.strptime(ex_date_str, '%Y-%m-%d').date()
-            except ValueError: continue
-            if ex_date_obj <= today_date: continue
-            # --- If row passes all checks up to here, process it ---
-            ex_date_cleaned = ex_date_obj.strftime('%Y-%m-%d')
-            final_exchange = exchange_val if exchange_val else get_exchange_cached(ticker_val)
-            record = { # Build the record
-                'Ticker': ticker_val, 'CompanyName': company_val, 'Ratio': ratio_val,
-                'ExDate': ex_date_cleaned, 'Exchange': final_exchange,
-                'fractional_share_handling': 'N/A (Forward Split)'
-            }
-            if is_reverse_split(ratio_val):
+        # --- Vectorized row validation/filtering (pandas) instead of a per-row Python loop ---
+        column_names = {config.TICKER_IDX: 'Ticker', config.COMPANY_NAME_IDX: 'CompanyName',
+                        config.RATIO_IDX: 'Ratio', config.EX_DATE_IDX: 'ExDate'}
+        if config.EXCHANGE_IDX is not None: column_names[config.EXCHANGE_IDX] = 'Exchange'
+        # Too-short rows are dropped once up front; one C-level itemgetter call per row then picks just the
+        # needed cells, so the frame is built narrow instead of padding/reindexing every scraped column
+        get_fields = itemgetter(*column_names)
+        rows_df = pd.DataFrame([get_fields(row) for row in all_row_data_values if len(row) >= MIN_EXPECTED_COLUMNS],
+                               columns=list(column_names.values())).fillna('').astype(str)
+        # Cheap string checks first (one mask over the essential columns): YYYY-MM-DD dates order like strings,
+        # so anything <= today's ISO date can't be upcoming and is dropped before the (comparatively costly) date parse
+        essential_ok = (rows_df[['Ticker', 'Ratio']].to_numpy() != '').all(axis=1)
+        rows_df = rows_df[essential_ok & (rows_df['ExDate'] > today_date.isoformat()).to_numpy()]
+        ex_dates = pd.to_datetime(rows_df['ExDate'], format='%Y-%m-%d', errors='coerce', cache=True) # cache: repeated dates parse once
+        keep_mask = ex_dates > pd.Timestamp(today_date)
+        rows_df = rows_df[keep_mask]
+        # A 10-character string that parsed as %Y-%m-%d is already canonical; only re-format unpadded ones like 2026-1-5
+        if not (rows_df['ExDate'].str.len() == 10).all():
+            rows_df = rows_df.assign(ExDate=ex_dates[keep_mask].dt.strftime('%Y-%m-%d'))
+        # One NumPy mask over the Ratio column; only the reverse-split positions are kept for the record loop
+        reverse_positions = are_reverse_splits(rows_df['Ratio']).nonzero()[0]
+
+        # --- Build records for the surviving rows only (columns filled vectorized, loop only over reverse splits) ---
+        if 'Exchange' not in rows_df: rows_df['Exchange'] = ''
+        missing_exchange = rows_df['Exchange'] == ''
+        exchange_by_ticker = get_exchanges(rows_df.loc[missing_exchange, 'Ticker'].unique()) # Uncached lookups run concurrently
+        rows_df.loc[missing_exchange, 'Exchange'] = rows_df.loc[missing_exchange, 'Ticker'].map(exchange_by_ticker)
+        rows_df['fractional_share_handling'] = 'N/A (Forward Split)'
+        final_analyzed_data = rows_df[['Ticker', 'CompanyName', 'Ratio', 'ExDate', 'Exchange', 'fractional_share_handling']].to_dict('records')
+        # Only the records are needed from here on; drop the raw rows and frames before the AI wait/notifications
+        del http_result, all_row_data_values, rows_df, ex_dates, keep_mask, missing_exchange
+
+        pending_ai = {} # (ticker, ratio) -> split_info
+        awaited_records = [] # Records waiting on the AI (merged and notified after it answers)
+        skipped_notified = 0
+        previous_classifications = None # Last run's CSV answers, read only if an already-notified split needs one
+        for record in (final_analyzed_data[i] for i in reverse_positions):
+            ticker_val, ratio_val = record['Ticker'], record['Ratio']
+            split_info = {'ticker': ticker_val, 'ratio': ratio_val, 'ex_date': record['ExDate'], 'exchange': record['Exchange']}
+            cached_classification = get_cached_classification(split_info)
+            recovered_classification = None
+            if not cached_classification and config.AI_SKIP_NOTIFIED and (ticker_val, record['ExDate']) in notified_keys_history:
+                if previous_classifications is None: previous_classifications = load_previous_classifications()
+                recovered_classification = previous_classifications.get((ticker_val, record['ExDate']))
+            if cached_classification:
+                record['fractional_share_handling'] = cached_classification # Known from a previous run
+            elif recovered_classification:
+                # Already posted and last run's answer is still in the CSV, so don't pay for a new one
+                record['fractional_share_handling'] = recovered_classification
+                skipped_notified += 1
+            else:
                 record['fractional_share_handling'] = 'Pending AI Analysis'
-                reverse_splits_to_analyze.append({
-                    'ticker': ticker_val, 'ratio': ratio_val, 'ex_date': ex_date_cleaned
-                })
-            initial_records.append(record) # Add the processed record
+                awaited_records.append(record)
+                pending_ai.setdefault((ticker_val, ratio_val), split_info) # Duplicate rows share one AI question
+        reverse_splits_to_analyze = list(pending_ai.values())
+        if skipped_notified:
+            print(f"Skipping AI for {skipped_notified} already-notified reverse splits (classification kept from the last run's CSV).")
 
-        print(f"DEBUG: Initial records count after filtering/processing: {len(initial_records)}") # <-- DEBUG PRINT 2
-        print(f"DEBUG: Reverse splits identified for AI: {len(reverse_splits_to_analyze)}") # <-- DEBUG PRINT 3
-        if initial_records: print(f"DEBUG: Example initial record: {initial_records[0]}") # <-- DEBUG PRINT 4 (Example Record)
+        log.debug("Records count after filtering/processing: %d", len(final_analyzed_data))
+        log.debug("Reverse splits identified for AI: %d", len(reverse_splits_to_analyze))
+        if final_analyzed_data: log.debug("Example initial record: %r", final_analyzed_data[0]) # repr only built at DEBUG
 
-        # --- AI Call ---
+        # --- AI Call (runs in the background while Chrome is closed and ready splits are notified) ---
         ai_results = {}
+        ai_future = None
         if ai_enabled and reverse_splits_to_analyze:
             print(f"\nSending batch request to AI for {len(reverse_splits_to_analyze)} reverse splits...")
-            ai_results = get_batch_ai_validation(reverse_splits_to_analyze)
-            print(f"DEBUG: AI Results Dictionary received: {ai_results}") # <-- DEBUG PRINT 5 (See AI Output Dict)
+            ai_executor = ThreadPoolExecutor(max_workers=1)
+            ai_future = ai_executor.submit(asyncio.run, get_batch_ai_validation_async(reverse_splits_to_analyze))
+            ai_executor.shutdown(wait=False)
+
+        # The table has been read, so Chrome can go now instead of idling until the end of the run
+        if not keep_driver: close_driver(driver)
+        driver = None
+
+        # --- Discord Notifications, part 1: splits that don't wait on the AI ---
+        notifications_complete = True
+        if webhook_url:
+            ready_records = [r for r in final_analyzed_data if r['fractional_share_handling'] != 'Pending AI Analysis']
+            notifications_complete = notify_new_splits(webhook_url, ready_records, notified_keys_history, current_run_notified_keys)
+        else:
+            print("No Discord webhook URL configured. Skipping notifications.")
+
+        if ai_future is not None:
+            ai_results = ai_future.result()
+            log.debug("AI Results Dictionary received: %r", ai_results)
             print(f"AI analysis complete.")
         # ... (other AI status prints) ...
 
-        # --- Merge AI Results ---
+        # --- Merge AI Results (in place, only the records collected as pending) ---
         print("\nMerging AI results into final data...")
         merged_count = 0
-        for record in initial_records: # Iterate initial records
-            # print(f"DEBUG: Processing record for merge: {record}") # <-- DEBUG PRINT (Optional, can be verbose)
-            if record['fractional_share_handling'] == 'Pending AI Analysis':
-                ticker = record.get('Ticker')
-                if ai_enabled:
-                    classification = ai_results.get(ticker, 'AI Analysis Failed/Missing')
-                    # print(f"DEBUG: Merging for {ticker}. Found AI result: {classification}") # <-- DEBUG PRINT (Optional)
-                    record['fractional_share_handling'] = classification
-                    if ticker in ai_results and classification not in ["AI Response Missing", "AI API Error", "AI Response Unclear", "AI Analysis Failed/Missing"]:
-                        merged_count +=1
-                else:
-                     record['fractional_share_handling'] = "AI Disabled"
-            final_analyzed_data.append(record) # Append processed record to final list
+        if not ai_enabled:
+            for record in awaited_records: record['fractional_share_handling'] = "AI Disabled"
+        else:
+            for record in awaited_records:
+                split_key = (record.get('Ticker'), record.get('Ratio')) # Same identity pending_ai was deduped by
+                classification = ai_results.get(split_key, 'AI Analysis Failed/Missing')
+                record['fractional_share_handling'] = classification
+                if split_key in ai_results and classification not in AI_FAILURE_RESULTS:
+                    merged_count +=1
 
         if ai_enabled and reverse_splits_to_analyze:
             print(f"Merged AI results for {merged_count} tickers (excluding errors/missing/unclear).")
-        print(f"DEBUG: Final records count before saving: {len(final_analyzed_data)}") # <-- DEBUG PRINT 6
-        if final_analyzed_data: print(f"DEBUG: Example final record: {final_analyzed_data[0]}") # <-- DEBUG PRINT 7 (Example Record)
+        log.debug("Final records count before saving: %d", len(final_analyzed_data))
+        if final_analyzed_data: log.debug("Example final record: %r", final_analyzed_data[0])
 
 
         # --- Save Final Analyzed Data to CSV ---
         if final_analyzed_data:
-            print(f"DEBUG: Attempting to save {len(final_analyzed_data)} records to CSV...") # <-- DEBUG PRINT 8
-            save_to_csv(final_analyzed_data)
+            run_complete = save_to_csv(final_analyzed_data)
+            if config.SAVE_PARQUET: save_to_parquet(final_analyzed_data)
+            if config.APPEND_CSV_HISTORY: append_to_csv(final_analyzed_data)
         else:
             print("No final data to save to CSV.")
+            run_complete = True
+        # Only records that went to the AI can hold a failure (cache/rule hits are always definitive)
+        classified_records = [r for r in awaited_records
+                              if r['fractional_share_handling'] not in AI_FAILURE_RESULTS and r['fractional_share_handling'] != "AI Disabled"]
+        unanswered_count = len(awaited_records) - len(classified_records)
+        if unanswered_count:
+            run_complete = False # Unanswered splits must be retried, so don't mark this table as done
+
+        # --- Discord Notifications, part 2: splits classified by the AI ---
+        # Unanswered splits are held back (not posted, not added to history) so a later run can post the real answer
+        if webhook_url and unanswered_count:
+            print(f"Holding back Discord notifications for {unanswered_count} reverse splits without a classification (retried next run).")
+        if webhook_url and classified_records:
+            if not notify_new_splits(webhook_url, classified_records, notified_keys_history, current_run_notified_keys):
+                notifications_complete = False
+        if not notifications_complete: run_complete = False
 
+        # Only a run with nothing left to retry lets an identical table be skipped next time
+        if run_complete: save_scrape_hash(scrape_hash)
 
     except KeyboardInterrupt: print("\nScript interrupted by user.")
     except Exception as e:
         print(f"\nFATAL ERROR in main execution: {type(e).__name__} - {e}")
         import traceback; traceback.print_exc()
     finally:
-        if driver:
-            print("\nClosing WebDriver...")
-            try: driver.quit()
-            except Exception as quit_err: print(f"Warning: Error closing WebDriver: {quit_err}")
-            print("WebDriver closed.")
-        # ... (optional history save) ...
+        if not keep_driver: close_driver(driver)
+        new_notified_keys = current_run_notified_keys - notified_keys_history
+        log.info("discord_notifications_sent=%d", len(new_notified_keys))
+        if new_notified_keys:
+            append_notified_history(new_notified_keys, notified_keys_history | new_notified_keys)
         end_time = time.time()
         print(f"\n--- Script Finished ({datetime.datetime.now():%Y-%m-%d %H:%M:%S}) ---")
-        print(f"--- Total Execution Time: {end_time - start_time:.2f} seconds ---")
\ No newline at end of file
+        print(f"--- Total Execution Time: {end_time - start_time:.2f} seconds ---")
+
+
+_stop_requested = False
+
+def _request_stop(signum, frame):
+    """SIGINT/SIGTERM handler for serve(): finish up and leave the loop."""
+    global _stop_requested
+    _stop_requested = True
+    raise KeyboardInterrupt
+
+def serve(interval):
+    """Runs main() every `interval` seconds in one process, reusing one warm Chrome across runs."""
+    if _IMPORT_ERROR is not None:
+        sys.exit(f"ERROR: Failed to import necessary module: {_IMPORT_ERROR}. Ensure all required .py files are present.")
+    signal.signal(signal.SIGINT, _request_stop)
+    signal.signal(signal.SIGTERM, _request_stop)
+    print(f"--- Serving: checking every {interval}s (Ctrl+C / SIGTERM to stop) ---")
+    try:
+        while not _stop_requested:
+            try: main(keep_driver=True)
+            except SystemExit as e: # main() exits early on "no data"/"unchanged"; keep serving
+                if e.code not in (None, 0): print(f"Warning: Run exited with {e.code}; retrying next interval.")
+            if _stop_requested: break
+            time.sleep(interval)
+    except KeyboardInterrupt: pass
+    finally:
+        print("\nStopping; closing the kept WebDriver...")
+        release_shared_driver()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Scrape upcoming stock splits, classify reverse splits and notify Discord.")
+    arg_parser.add_argument("--serve", type=float, metavar="SECONDS", help="keep running, checking every SECONDS")
+    args = arg_parser.parse_args()
+    if args.serve: serve(args.serve)
+    else: main()
@@ -1,29 +1,296 @@
 # scraper.py
-"""Handles the Selenium web scraping process for the initial data."""
+"""Handles the web scraping process for the initial data (JSON API or plain HTTP first, Selenium fallback)."""
 
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.wait import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import NoSuchElementException, TimeoutException, StaleElementReferenceException
+# Selenium is imported inside the browser functions: most runs are served by the plain HTTP fetch
 # Removed unused import: from urllib.parse import quote_plus
+from html.parser import HTMLParser
+import datetime
+import logging
+import requests
+import os
 import time # Keep time if used elsewhere, otherwise remove
 import config
 
-# --- Keep setup_driver ---
-def setup_driver():
-    """Initializes and returns a Selenium WebDriver instance."""
-    print("Initializing Selenium WebDriver..."); options = webdriver.ChromeOptions()
+# Optional: lxml's C HTML parser is used for the plain HTTP scrape when installed, else html.parser
+try:
+    from lxml import html as lxml_html
+except ImportError:
+    lxml_html = None
+
+log = logging.getLogger(__name__)
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/98.0.4758.102 Safari/537.36"
+TABLE_ID = "latest_splits"
+# Request patterns Chrome is told to block (never needed to read the table)
+BLOCKED_URL_PATTERNS = [
+    '*.doubleclick.net/*', '*google-analytics.com/*', '*googletagmanager.com/*',
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.svg', '*.woff*', '*.ttf', '*.css',
+]
+
+# Shared session so repeat fetches reuse the connection
+_http_session = requests.Session()
+_http_session.headers.update({"User-Agent": USER_AGENT})
+
+# Waits for table#<arguments[0]> to get its first body row via a MutationObserver (event-driven instead of
+# WebDriverWait's 0.5 s polling; bounded by the driver's script timeout), stops any sub-resources still loading,
+# then resolves with {headers: [th text, ...], rows: [[cell value, ...], ...]} (headers null without a thead,
+# rows null without a tbody) -- waiting and extraction share a single WebDriver round-trip.
+# Cell value is data-val if present, else its textContent with whitespace collapsed (same as the HTTP parser);
+# textContent is used over innerText because innerText forces a style/layout pass on every read.
+# Rows whose cell arguments[1] (ex-date, YYYY-MM-DD) is not after arguments[2] are dropped in the
+# browser, so past splits are never shipped back over the WebDriver connection.
+_WAIT_AND_EXTRACT_TABLE_JS = """
+const tableId = arguments[0], exIdx = arguments[1], after = arguments[2], done = arguments[arguments.length - 1];
+const text = el => (el.textContent || '').replace(/\\s+/g, ' ').trim();
+const extract = table => {
+    window.stop();
+    const thead = table.querySelector('thead'), tbody = table.querySelector('tbody');
+    return {
+        headers: thead ? Array.from(thead.querySelectorAll('th'), text) : null,
+        rows: tbody ? Array.from(tbody.querySelectorAll('tr'), row =>
+            Array.from(row.querySelectorAll('td'), c => (c.getAttribute('data-val') || text(c)).trim()))
+            .filter(cells => cells[exIdx] && cells[exIdx] > after) : null
+    };
+};
+const ready = () => document.querySelector('#' + tableId + ' tbody tr') ? document.getElementById(tableId) : null;
+if (ready()) return done(extract(ready()));
+new MutationObserver((_, obs) => { const table = ready(); if (table) { obs.disconnect(); done(extract(table)); } })
+    .observe(document.documentElement, {childList: true, subtree: true});
+"""
+
+# --- Plain HTTP scrape (no browser) for server-rendered tables ---
+class _SplitTableParser(HTMLParser):
+    """Collects header texts and row cell values (data-val, else text) from table#latest_splits."""
+    def __init__(self):
+        super().__init__()
+        self.found_table = False
+        self.headers, self.rows = [], []
+        self._table_depth = 0 # >0 while inside the target table
+        self._section = None # 'thead' / 'tbody'
+        self._row = None
+        self._cell = None # [data-val or None, [text parts]] while inside a th/td
+
+    def handle_starttag(self, tag, attrs):
+        if self._table_depth:
+            if tag == 'table': self._table_depth += 1
+            elif tag in ('thead', 'tbody'): self._section = tag
+            elif tag == 'tr' and self._section == 'tbody': self._row = []
+            elif tag in ('th', 'td'): self._cell = [dict(attrs).get('data-val'), []]
+        elif tag == 'table' and dict(attrs).get('id') == TABLE_ID:
+            self.found_table = True
+            self._table_depth = 1
+
+    def handle_endtag(self, tag):
+        if not self._table_depth: return
+        if tag == 'table': self._table_depth -= 1
+        elif tag in ('thead', 'tbody'): self._section = None
+        elif tag in ('th', 'td') and self._cell is not None:
+            data_val, parts = self._cell
+            value = (data_val or ' '.join(''.join(parts).split())).strip()
+            if self._section == 'thead' and tag == 'th': self.headers.append(value)
+            elif self._row is not None and tag == 'td': self._row.append(value)
+            self._cell = None
+        elif tag == 'tr' and self._row is not None:
+            self.rows.append(self._row)
+            self._row = None
+
+    def handle_data(self, data):
+        if self._cell is not None: self._cell[1].append(data)
+
+def _cell_value(cell):
+    """data-val if present, else the cell's text with whitespace collapsed (matches _SplitTableParser)."""
+    return (cell.get('data-val') or ' '.join(cell.text_content().split())).strip()
+
+def _parse_split_table(response):
+    """Parses table#latest_splits from an HTTP response. Returns (headers, rows), or None if the table is absent."""
+    if lxml_html is not None:
+        # Raw bytes: lxml honours the page's <meta charset> itself, skipping requests' text decoding/guessing
+        tables = lxml_html.fromstring(response.content).xpath('//table[@id=$table_id]', table_id=TABLE_ID)
+        if not tables: return None
+        headers = [_cell_value(th) for th in tables[0].xpath('./thead//th')]
+        rows = [[_cell_value(td) for td in tr.xpath('./td')] for tr in tables[0].xpath('./tbody/tr')]
+        return headers, rows
+    parser = _SplitTableParser()
+    parser.feed(response.text)
+    return (parser.headers, parser.rows) if parser.found_table else None
+
+def fetch_split_data_http(url):
+    """
+    Fetches the page with a plain GET and parses the split table without a browser.
+    Returns (headers, rows) like scrape_split_data, or None if the table is not in
+    the served HTML (e.g. JS-rendered) or the request fails -- callers fall back to Selenium.
+    """
+    print(f"Fetching {url} over HTTP for initial split list...")
+    try:
+        response = _http_session.get(url, timeout=15)
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        print(f"Warning: HTTP fetch failed: {e}")
+        return None
+    parsed = _parse_split_table(response)
+    if parsed is None or not parsed[1]:
+        print(f"Table (ID: {TABLE_ID}) not present in served HTML; it is likely rendered by JavaScript.")
+        return None
+    headers, rows = parsed
+    all_row_data_values = [row for row in rows if any(row)]
+    print(f"Extracted data from {len(all_row_data_values)} non-empty rows via HTTP.")
+    return headers, all_row_data_values
+
+def fetch_split_data_api(api_url):
+    """
+    Fetches split rows straight from the JSON endpoint behind the table (no HTML, no browser).
+    Accepts a list of row arrays, or of objects ordered by config.SPLIT_API_COLUMNS, either at the
+    top level or as the first list value of a wrapper object. Returns (headers, rows) or None.
+    """
+    print(f"Fetching {api_url} for initial split list (JSON API)...")
+    try:
+        response = _http_session.get(api_url, headers={"Accept": "application/json"}, timeout=15)
+        response.raise_for_status()
+        payload = response.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"Warning: Split API fetch failed: {e}")
+        return None
+    if isinstance(payload, dict):
+        payload = next((v for v in payload.values() if isinstance(v, list)), None)
+    if not isinstance(payload, list) or not payload:
+        print("Warning: Split API returned no rows.")
+        return None
+    columns = config.SPLIT_API_COLUMNS
+    rows = []
+    for item in payload:
+        if isinstance(item, dict):
+            if not columns:
+                print("Warning: Split API returns objects but SPLIT_API_COLUMNS is not set.")
+                return None
+            item = [item.get(col) for col in columns]
+        if isinstance(item, list):
+            rows.append(['' if v is None else str(v).strip() for v in item])
+    all_row_data_values = [row for row in rows if any(row)]
+    print(f"Extracted data from {len(all_row_data_values)} non-empty rows via the split API.")
+    return list(columns), all_row_data_values
+
+def _chrome_options(profile_dir=None):
+    """Builds ChromeOptions; with profile_dir, Chrome reuses that user-data-dir (HTTP cache, DNS, TLS tickets)."""
+    from selenium import webdriver
+    options = webdriver.ChromeOptions()
     options.add_argument('--headless'); options.add_argument('--no-sandbox')
     options.add_argument('--disable-dev-shm-usage'); options.add_argument('--log-level=3')
-    options.add_argument("user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/98.0.4758.102 Safari/537.36")
+    # Nothing on the page needs GPU compositing, extensions or background services
+    options.add_argument('--disable-gpu'); options.add_argument('--disable-extensions')
+    options.add_argument('--disable-background-networking'); options.add_argument('--mute-audio')
+    # First-run/profile chores that otherwise run at every fresh launch
+    options.add_argument('--disable-sync'); options.add_argument('--disable-default-apps')
+    options.add_argument('--disable-translate'); options.add_argument('--metrics-recording-only')
+    options.add_argument('--no-first-run')
+    options.add_argument(f"user-agent={USER_AGENT}")
+    # Only the table's HTML is needed: return once the DOM is ready and skip images/CSS/fonts
+    options.page_load_strategy = 'eager'
+    options.add_argument('--blink-settings=imagesEnabled=false')
+    options.add_experimental_option('prefs', {
+        'profile.managed_default_content_settings.images': 2,
+        'profile.managed_default_content_settings.stylesheets': 2,
+        'profile.managed_default_content_settings.fonts': 2,
+        'profile.managed_default_content_settings.plugins': 2,
+        'permissions.default.stylesheet': 2,
+    })
+    options.add_experimental_option('excludeSwitches', ['enable-automation'])
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+        options.add_argument(f'--user-data-dir={profile_dir}')
+        options.add_argument(f"--disk-cache-dir={os.path.join(profile_dir, 'cache')}")
+        options.add_argument(f'--disk-cache-size={config.CHROME_DISK_CACHE_SIZE}')
+    return options
+
+def _block_urls(driver):
+    """Drops ad/tracker/static-asset requests at the network layer before navigation."""
+    try:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_URL_PATTERNS})
+    except Exception as cdp_err:
+        print(f"Warning: Could not set CDP URL blocking: {cdp_err}")
+
+# Session ids of drivers attached to a shared, externally managed Chrome (quit_driver must leave it running)
+_attached_sessions = set()
+
+def _attach_driver(debugger_address):
+    """Attaches to a running Chrome at debugger_address and opens a tab for this run. Returns None on failure."""
+    from selenium import webdriver
+    options = webdriver.ChromeOptions()
+    # Launch flags/prefs don't apply to an existing browser; chromedriver only needs the address
+    options.add_experimental_option('debuggerAddress', debugger_address)
+    options.page_load_strategy = 'eager'
     try:
         driver = webdriver.Chrome(options=options)
-        print("WebDriver initialized.")
-        return driver
+        driver.switch_to.new_window('tab')
     except Exception as e:
-        print(f"Error initializing WebDriver: {e}")
+        print(f"Warning: Could not attach to Chrome at {debugger_address}: {e}. Launching a new instance...")
         return None
+    _attached_sessions.add(driver.session_id)
+    _block_urls(driver)
+    print(f"WebDriver attached to running Chrome at {debugger_address}.")
+    return driver
+
+def quit_driver(driver):
+    """Ends the WebDriver session; for an attached Chrome, only this run's tab is closed."""
+    global _shared_driver
+    if driver is _shared_driver: _shared_driver = None
+    if driver.session_id in _attached_sessions:
+        _attached_sessions.discard(driver.session_id)
+        try: driver.close()
+        finally: driver.quit() # chromedriver doesn't shut down a browser it didn't launch
+    else:
+        driver.quit()
+
+# --- Keep setup_driver ---
+def setup_driver():
+    """Initializes and returns a Selenium WebDriver instance."""
+    print("Initializing Selenium WebDriver...")
+    from selenium import webdriver
+    if config.CHROME_DEBUGGER_ADDRESS:
+        driver = _attach_driver(config.CHROME_DEBUGGER_ADDRESS)
+        if driver: return driver
+    # Warm profile first; Chrome locks a profile dir to one instance, so fall back to a fresh one
+    profile_attempts = [config.CHROME_PROFILE_DIR, None] if config.CHROME_PROFILE_DIR else [None]
+    for profile_dir in profile_attempts:
+        try:
+            driver = webdriver.Chrome(options=_chrome_options(profile_dir))
+        except Exception as e:
+            if profile_dir:
+                print(f"Warning: Could not start Chrome with profile '{profile_dir}' (in use?): {e}. Retrying with a fresh profile...")
+                continue
+            print(f"Error initializing WebDriver: {e}")
+            return None
+        _block_urls(driver)
+        print("WebDriver initialized.")
+        return driver
+
+# Driver kept warm between runs when the checker runs as a long-lived process (see get_driver)
+_shared_driver = None
+
+def get_driver(reuse=False):
+    """
+    Returns a WebDriver. With reuse=True the same instance is handed out on every call while it
+    stays responsive, so repeated runs in one process skip Chrome startup; quit_driver releases it.
+    """
+    global _shared_driver
+    if reuse and _shared_driver is not None:
+        try:
+            _shared_driver.current_url # Cheap liveness probe
+            return _shared_driver
+        except Exception as e:
+            print(f"Warning: Kept WebDriver is unresponsive ({type(e).__name__}); starting a new one.")
+            try: quit_driver(_shared_driver)
+            except Exception: pass
+            _shared_driver = None
+    driver = setup_driver()
+    if reuse: _shared_driver = driver
+    return driver
+
+def release_shared_driver():
+    """Quits the driver kept by get_driver(reuse=True), if any."""
+    if _shared_driver is not None:
+        try: quit_driver(_shared_driver)
+        except Exception as e: print(f"Warning: Error closing WebDriver: {e}")
 
 def scrape_split_data(driver, url):
     """Navigates to the URL and scrapes the initial split data table."""
@@ -31,71 +298,37 @@ def scrape_split_data(driver, url):
         print("Error: WebDriver not initialized for initial scrape.")
         return [], [] # Return empty lists
 
+    from selenium.common.exceptions import TimeoutException
     print(f"Navigating to {url} for initial split list...");
-    table_element = None # Initialize table_element outside the try block
 
-    # --- Try block for navigation and finding the main table ---
+    # --- Navigation, then one async script that waits for the table and extracts it ---
     try:
         driver.get(url)
         wait_time = config.SELENIUM_WAIT_TIME
         print(f"Waiting up to {wait_time}s for table...")
-        # Adjust the ID if your table has a different ID
-        table_element = WebDriverWait(driver, wait_time).until(
-            EC.presence_of_element_located((By.ID, "latest_splits"))
-        )
-        WebDriverWait(table_element, wait_time).until(
-            EC.visibility_of_element_located((By.CSS_SELECTOR, "tbody tr"))
-        )
-        print("Initial table content detected.")
-
-    # --- CORRECT INDENTATION: except blocks aligned with the try block above ---
-    except TimeoutException:
-        print(f"Error: Timed out waiting for initial table (ID: latest_splits) at {url}.")
+        driver.set_script_timeout(wait_time)
+        extracted = driver.execute_async_script(_WAIT_AND_EXTRACT_TABLE_JS, TABLE_ID, config.EX_DATE_IDX, datetime.date.today().isoformat())
+        print("Initial table content detected; header and row data extracted.")
+    except TimeoutException: # Also raised when the async wait script hits the script timeout
+        print(f"Error: Timed out waiting for initial table (ID: {TABLE_ID}) at {url}.")
         return [], [] # Return empty lists on timeout
     except Exception as nav_err:
         print(f"Error during navigation/wait for table: {nav_err}")
         return [], [] # Return empty lists on other navigation errors
-    # --- End of except blocks ---
 
-    # --- Header and Row extraction only proceed if the table was found ---
-    if table_element is None:
-        print("Error: table_element could not be found or assigned, cannot proceed with scraping.")
-        return [], []
-
-    headers = []
-    try:
-        thead = table_element.find_element(By.TAG_NAME, "thead")
-        headers = [th.text.strip() for th in thead.find_elements(By.TAG_NAME, "th")]
-        print(f"DEBUG: Headers: {headers}")
-    except Exception as header_err:
-        print(f"Warning: Could not parse initial table headers: {header_err}")
-
-    all_row_data_values = []
-    print("Extracting row data...")
-    try:
-        tbody = table_element.find_element(By.TAG_NAME, "tbody")
-        rows = tbody.find_elements(By.TAG_NAME, "tr")
-        print(f"Found {len(rows)} rows.")
-    except NoSuchElementException:
+    headers = extracted.get('headers')
+    if headers is None:
+        print("Warning: Could not parse initial table headers: no thead found.")
+        headers = []
+    log.debug("Headers: %r", headers)
+    raw_rows = extracted.get('rows')
+    if raw_rows is None:
         print("Error: Could not find tbody.")
         # Return headers (if found) but empty data list
         return headers, []
-
-    for i, row_element in enumerate(rows):
-        try:
-            cells = row_element.find_elements(By.TAG_NAME, "td")
-            current_row_values = [(c.get_attribute('data-val') or c.text or '').strip() for c in cells]
-            # Only append if row has any data to avoid empty lists
-            if any(current_row_values):
-                all_row_data_values.append(current_row_values)
-        except StaleElementReferenceException:
-            print(f"Warning: Row {i+1} became stale during processing. Skipping.")
-            # Continue to the next row if one becomes stale
-            continue
-        except Exception as e:
-            print(f"Warning: Error processing cells in row {i+1}: {e}. Skipping row.")
-            # Continue to the next row if there's an error with cells
-            continue
+    print(f"Found {len(raw_rows)} rows with upcoming ex-dates.")
+    # Only keep rows with any data to avoid empty lists
+    all_row_data_values = [row for row in raw_rows if any(row)]
 
     print(f"Extracted data from {len(all_row_data_values)} non-empty rows from initial table.")
     return headers, all_row_data_values
@@ -0,0 +1,13 @@
+# tests/_sandbox.py
+"""Imported first by every test module: puts the repo on sys.path and points all runtime files at a temp dir."""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+
+TMP_DIR = tempfile.mkdtemp(prefix='split_checker_tests_')
+# Module defaults bind these paths at import time, so they must be redirected before any other repo module loads
+for _name in [n for n in vars(config) if n.endswith('_PATH') or (n.endswith('_DIR') and n != 'BASE_DIR')]:
+    setattr(config, _name, os.path.join(TMP_DIR, os.path.basename(getattr(config, _name))))
@@ -0,0 +1,107 @@
+# tests/test_ai_cache.py
+"""Tests for the persistent AI classification cache (TTL, ex-date eviction, announcement scoping)."""
+import os
+import tempfile
+import types
+import unittest
+
+from _sandbox import TMP_DIR
+import config
+import ai_handler
+
+
+class _FakeModel:
+    """Stands in for genai.GenerativeModel: answers every ticker with the same phrase (or per ratio asked about)."""
+    answer = config.OUTPUT_CASH
+    answer_by_ratio = {}
+    calls = 0
+
+    def __init__(self, name): pass
+
+    def generate_content(self, prompt, generation_config=None):
+        _FakeModel.calls += 1
+        answer = next((a for r, a in _FakeModel.answer_by_ratio.items() if f"ABC's {r} " in prompt), _FakeModel.answer)
+        return types.SimpleNamespace(text=f"1. ABC: {answer}")
+
+
+class AICacheTest(unittest.TestCase):
+    SPLIT = {'ticker': 'ABC', 'ratio': '1:10', 'ex_date': '2099-01-15', 'exchange': 'NYSE'}
+
+    def setUp(self):
+        self.cache_path = os.path.join(tempfile.mkdtemp(dir=TMP_DIR), 'cache')
+        self._reopen()
+        ai_handler._genai = types.SimpleNamespace(GenerativeModel=_FakeModel)
+        ai_handler._GEMINI_API_KEY_CONFIGURED = 'test-key'
+        _FakeModel.calls = 0
+        _FakeModel.answer_by_ratio = {}
+
+    def tearDown(self):
+        ai_handler._cache.close()
+        _FakeModel.answer_by_ratio = {}
+
+    def _reopen(self):
+        """Opens the cache from disk again, as the next run of the script would."""
+        if ai_handler._cache is not None: ai_handler._cache.close()
+        ai_handler._cache, ai_handler._cache_memo = ai_handler._open_ai_cache(self.cache_path)
+
+    def _expire_all(self):
+        """Ages every stored entry just past the TTL and reopens the cache."""
+        for key in list(ai_handler._cache.keys()):
+            entry = dict(ai_handler._cache[key])
+            entry['ts'] -= ai_handler._AI_CACHE_TTL + 60
+            ai_handler._cache[key] = entry
+        ai_handler._cache.sync()
+        self._reopen()
+
+    def test_entry_past_ttl_is_evicted_and_asked_again(self):
+        ai_handler.get_batch_ai_validation([self.SPLIT])
+        self.assertEqual(ai_handler.get_cached_classification(self.SPLIT), config.OUTPUT_CASH)
+        self._expire_all()
+        self.assertEqual(ai_handler._cache_memo, {})
+        self.assertIsNone(ai_handler.get_cached_classification(self.SPLIT))
+        ai_handler.get_batch_ai_validation([self.SPLIT])
+        self.assertEqual(_FakeModel.calls, 2)
+
+    def test_entry_past_its_ex_date_is_evicted(self):
+        past = dict(self.SPLIT, ex_date='2000-01-15')
+        ai_handler.get_batch_ai_validation([past])
+        self.assertIsNone(ai_handler.get_cached_classification(past)) # Within TTL, but the split already happened
+        self._reopen()
+        self.assertEqual(len(ai_handler._cache), 0)
+
+    def test_equivalent_ratios_in_one_batch_share_one_answer(self):
+        same_split = dict(self.SPLIT, ratio='1-for-10') # Normalizes to the same structural key
+        ai_handler.get_batch_ai_validation([self.SPLIT, same_split])
+        self.assertEqual(_FakeModel.calls, 1)
+        self.assertEqual(ai_handler.get_cached_classification(self.SPLIT), config.OUTPUT_CASH)
+        self.assertEqual(ai_handler.get_cached_classification(same_split), config.OUTPUT_CASH)
+
+    def test_two_ratios_for_one_ticker_are_asked_and_cached_separately(self):
+        other_split = dict(self.SPLIT, ratio='1:20')
+        _FakeModel.answer_by_ratio = {'1:20': config.OUTPUT_ROUND_UP}
+        results = ai_handler.get_batch_ai_validation([self.SPLIT, other_split])
+        self.assertEqual(_FakeModel.calls, 2) # Same ticker can't share one prompt
+        self.assertEqual(results, {('ABC', '1:10'): config.OUTPUT_CASH, ('ABC', '1:20'): config.OUTPUT_ROUND_UP})
+        self.assertEqual(ai_handler.get_cached_classification(self.SPLIT), config.OUTPUT_CASH)
+        self.assertEqual(ai_handler.get_cached_classification(other_split), config.OUTPUT_ROUND_UP)
+
+    def test_unable_to_determine_is_not_cached(self):
+        _FakeModel.answer = config.OUTPUT_UNKNOWN
+        try:
+            self.assertEqual(ai_handler.get_batch_ai_validation([self.SPLIT]), {('ABC', '1:10'): config.OUTPUT_UNKNOWN})
+        finally:
+            _FakeModel.answer = config.OUTPUT_CASH
+        self.assertIsNone(ai_handler.get_cached_classification(self.SPLIT))
+        self.assertEqual(len(ai_handler._cache), 0)
+
+    def test_structural_match_is_scoped_to_the_announcement(self):
+        ai_handler.get_batch_ai_validation([self.SPLIT])
+        # Same announcement: reformatted ratio, ex-date moved a week into the next month
+        shifted = dict(self.SPLIT, ratio='1-for-10', ex_date='2099-02-05')
+        self.assertEqual(ai_handler.get_cached_classification(shifted), config.OUTPUT_CASH)
+        # Same ticker and ratio a year later is a new corporate action and must be asked again
+        later = dict(self.SPLIT, ex_date='2100-01-15')
+        self.assertIsNone(ai_handler.get_cached_classification(later))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,27 @@
+# tests/test_data_utils.py
+"""Tests for the persisted exchange lookup cache."""
+import json
+import os
+import unittest
+from unittest import mock
+
+import _sandbox # noqa: F401 (repo on sys.path, runtime files redirected)
+import config
+import data_utils
+
+
+class ExchangeCacheFlushTest(unittest.TestCase):
+    def setUp(self):
+        if os.path.exists(config.EXCHANGE_CACHE_PATH): os.remove(config.EXCHANGE_CACHE_PATH)
+        data_utils.exchange_cache.clear()
+
+    def test_new_lookups_are_written_before_exit(self):
+        fake_lookup = lambda ticker: data_utils._cache_exchange(ticker, 'NYSE')
+        with mock.patch.object(data_utils, '_lookup_one', fake_lookup):
+            self.assertEqual(data_utils.get_exchanges(['AAA', 'BBB']), {'AAA': 'NYSE', 'BBB': 'NYSE'})
+        with open(config.EXCHANGE_CACHE_PATH, encoding='utf-8') as f: saved = json.load(f)
+        self.assertEqual({t: e['exchange'] for t, e in saved.items()}, {'AAA': 'NYSE', 'BBB': 'NYSE'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,28 @@
+# tests/test_file_handler.py
+"""Tests for reading back the last run's CSV classifications."""
+import csv
+import os
+import tempfile
+import unittest
+
+import _sandbox # noqa: F401 (repo on sys.path, runtime files redirected)
+import config
+import file_handler
+
+
+class PreviousClassificationsTest(unittest.TestCase):
+    def test_only_definitive_answers_are_recovered(self):
+        path = os.path.join(tempfile.mkdtemp(), 'analyzed_upcoming_splits.csv')
+        rows = [('AAA', config.OUTPUT_CASH), ('BBB', config.OUTPUT_ROUND_UP),
+                ('CCC', config.OUTPUT_UNKNOWN), ('DDD', 'AI API Error')]
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=['Ticker', 'ExDate', 'fractional_share_handling'])
+            writer.writeheader()
+            for ticker, result in rows:
+                writer.writerow({'Ticker': ticker, 'ExDate': '2099-01-15', 'fractional_share_handling': result})
+        self.assertEqual(file_handler.load_previous_classifications(path),
+                         {('AAA', '2099-01-15'): config.OUTPUT_CASH, ('BBB', '2099-01-15'): config.OUTPUT_ROUND_UP})
+
+
+if __name__ == '__main__':
+    unittest.main()
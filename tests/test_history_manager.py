@@ -0,0 +1,45 @@
+# tests/test_history_manager.py
+"""Tests for loading and saving the notification history file."""
+import os
+import tempfile
+import unittest
+
+import _sandbox # noqa: F401 (repo on sys.path, runtime files redirected)
+import history_manager
+
+
+class NotificationHistoryRoundTripTest(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'notified_splits_history.log')
+
+    def _write(self, text):
+        with open(self.path, 'w', encoding='utf-8') as f: f.write(text)
+
+    def _read(self):
+        with open(self.path, encoding='utf-8') as f: return f.read()
+
+    def test_load_save_round_trip_keeps_lines(self):
+        lines = ['AAA_2099-01-15', 'BRK_B_2099-02-01', 'XYZ_NODATE']
+        self._write('\n'.join(lines) + '\n')
+        keys = history_manager.load_notified_history(self.path)
+        self.assertEqual(keys, {('AAA', '2099-01-15'), ('BRK_B', '2099-02-01'), ('XYZ', 'NODATE')})
+        history_manager.save_notified_history(keys, self.path)
+        self.assertEqual(self._read(), '\n'.join(sorted(lines)) + '\n')
+        self.assertEqual(history_manager.load_notified_history(self.path), keys)
+
+    def test_malformed_and_long_past_lines_are_dropped(self):
+        self._write('NODATE\n\nOLD_2000-01-01\nAAA_2099-01-15\n')
+        keys = history_manager.load_notified_history(self.path)
+        self.assertEqual(keys, {('AAA', '2099-01-15')})
+        history_manager.save_notified_history(keys, self.path)
+        self.assertEqual(self._read(), 'AAA_2099-01-15\n')
+
+    def test_append_writes_only_new_keys(self):
+        self._write('AAA_2099-01-15\n')
+        keys = history_manager.load_notified_history(self.path)
+        history_manager.append_notified_history({('BBB', '2099-03-01')}, keys | {('BBB', '2099-03-01')}, self.path)
+        self.assertEqual(self._read(), 'AAA_2099-01-15\nBBB_2099-03-01\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+# tests/test_serve_cycles.py
+"""Runs the full pipeline (main()) more than once in one process, as --serve does."""
+import asyncio
+import os
+import re
+import sys
+import tempfile
+import types
+import unittest
+
+from _sandbox import TMP_DIR
+import config
+
+# run_split_checker reads its secrets from the user's main.py
+sys.modules.setdefault('main', types.SimpleNamespace(GEMINI_API_KEY='test-key', URL='https://example.invalid/splits',
+                                                     DISCORD_WEBHOOK_URL='https://example.invalid/webhook'))
+import ai_handler
+import run_split_checker
+
+
+class _FakeModel:
+    """Stands in for genai.GenerativeModel. Like the real async gRPC client, the async API only works on the first loop."""
+    answer = config.OUTPUT_CASH
+    fail = False # Simulates an API outage
+    calls = 0
+    _bound_loop = None
+
+    def __init__(self, name): pass
+
+    def _reply(self, prompt):
+        _FakeModel.calls += 1
+        if _FakeModel.fail: raise RuntimeError("503 Service Unavailable")
+        tickers = re.findall(r"Is (\w+)'s", prompt)
+        return types.SimpleNamespace(text="\n".join(f"{i}. {t}: {_FakeModel.answer}" for i, t in enumerate(tickers, 1)))
+
+    def generate_content(self, prompt, generation_config=None):
+        return self._reply(prompt)
+
+    async def generate_content_async(self, prompt, generation_config=None):
+        loop = asyncio.get_running_loop()
+        if _FakeModel._bound_loop is None: _FakeModel._bound_loop = loop
+        if loop is not _FakeModel._bound_loop: raise RuntimeError("Event loop is closed")
+        return self._reply(prompt)
+
+
+class ServeCyclesTest(unittest.TestCase):
+    def setUp(self):
+        work_dir = tempfile.mkdtemp(dir=TMP_DIR)
+        if ai_handler._cache is not None: ai_handler._cache.close()
+        ai_handler._cache, ai_handler._cache_memo = ai_handler._open_ai_cache(os.path.join(work_dir, 'ai_results_cache'))
+        ai_handler._genai = types.SimpleNamespace(GenerativeModel=_FakeModel)
+        _FakeModel.calls, _FakeModel._bound_loop, _FakeModel.fail = 0, None, False
+        # Start from a clean slate of the run's state files (already redirected by _sandbox)
+        for name in ('HISTORY_FILE_PATH', 'FINAL_CSV_FILE_PATH', 'SCRAPE_HASH_PATH'):
+            if os.path.exists(getattr(config, name)): os.remove(getattr(config, name))
+        self._patch(run_split_checker, 'get_exchanges', lambda tickers: {t: 'NYSE' for t in tickers})
+        self.rows = []
+        self._patch(run_split_checker, 'fetch_split_data_http', lambda url: (['Ticker'], self.rows))
+        self.posted = []
+        self._patch(run_split_checker, 'send_discord_notifications_batch', lambda url, splits: self.posted.extend(splits) or list(splits))
+
+    def _patch(self, target, name, value):
+        original = getattr(target, name)
+        setattr(target, name, value)
+        self.addCleanup(setattr, target, name, original)
+
+    def _run_cycle(self, rows):
+        self.rows = rows
+        try: run_split_checker.main(keep_driver=True)
+        except SystemExit: pass
+
+    def test_second_cycle_still_reaches_gemini(self):
+        self._run_cycle([['AAA', '', 'A co', '1:10', '2099-02-01']])
+        self._run_cycle([['BBB', '', 'B co', '1:20', '2099-03-01']])
+        self.assertEqual(_FakeModel.calls, 2)
+        self.assertEqual([(r['Ticker'], r['fractional_share_handling']) for r in self.posted],
+                         [('AAA', config.OUTPUT_CASH), ('BBB', config.OUTPUT_CASH)])
+
+    def test_failed_classification_is_held_back_until_answered(self):
+        rows = [['AAA', '', 'A co', '1:10', '2099-02-01']]
+        _FakeModel.fail = True
+        self._run_cycle(rows)
+        self.assertEqual(self.posted, []) # Not posted with "AI API Error", not recorded as notified
+        _FakeModel.fail = False
+        self._run_cycle(rows) # Same table: not skipped as unchanged, since the last run left work to retry
+        self.assertEqual([(r['Ticker'], r['fractional_share_handling']) for r in self.posted], [('AAA', config.OUTPUT_CASH)])
+
+
+if __name__ == '__main__':
+    unittest.main()